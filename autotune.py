@@ -0,0 +1,376 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import threading
+import time
+from PIL import Image, ImageDraw, ImageFont
+from mineru_vl_utils import MinerUSamplingParams
+from mineru_vl_utils.mineru_client import DEFAULT_PROMPTS
+
+from cpu_profile import configured_intra_op_threads
+from file_utils import atomic_write_text
+from model_registry import model_revision
+
+# 调优结果按 机器指纹/模型 保存在此文件中，之后启动直接复用
+DEFAULT_AUTOTUNE_PATH = os.environ.get(
+    "OCR_AUTOTUNE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "pdf_ocr", "autotune.json")
+)
+
+# 依次尝试的批大小
+BATCH_SIZE_CANDIDATES = (1, 2, 4, 8, 16, 32)
+
+# 合成负载中随机组词用的字符
+SYNTHETIC_WORDS = (
+    "the", "model", "page", "layout", "table", "formula", "recognition", "document", "figure", "section",
+    "识别", "文档", "表格", "公式", "版面", "模型", "页面", "结果", "数据", "方法",
+)
+
+
+def _physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def _cuda():
+    import torch
+    return torch if torch.cuda.is_available() else None
+
+
+def machine_fingerprint():
+    """
+    返回 (指纹, 描述)：主机名、CPU、内存、torch 版本和各 GPU 型号/显存，任一变化都会重新调优
+    """
+    import torch
+    parts = [
+        platform.node(), platform.machine(), platform.processor() or "",
+        f"{os.cpu_count()} cpus", f"{_physical_memory() >> 30} GiB", f"torch {torch.__version__}",
+    ]
+    cuda = _cuda()
+    if cuda is not None:
+        for index in range(cuda.cuda.device_count()):
+            props = cuda.cuda.get_device_properties(index)
+            parts.append(f"{props.name} {props.total_memory >> 20} MiB")
+    description = ", ".join(part for part in parts if part)
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()[:16], description
+
+
+def default_memory_budget():
+    """
+    OCR_AUTOTUNE_MEMORY_GB 指定内存预算；缺省为全部显存的 90%，无 GPU 时为物理内存的 80%
+    """
+    memory_gb = os.environ.get("OCR_AUTOTUNE_MEMORY_GB")
+    if memory_gb:
+        return int(float(memory_gb) * (1 << 30))
+    cuda = _cuda()
+    if cuda is not None:
+        total = sum(cuda.cuda.get_device_properties(i).total_memory for i in range(cuda.cuda.device_count()))
+        return int(total * 0.9)
+    return int(_physical_memory() * 0.8)
+
+
+def _resident_bytes():
+    # Linux 下读取当前进程常驻内存，其他系统退回历史峰值
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_in_use():
+    """
+    有 GPU 时为各卡已分配显存之和，否则为进程常驻内存
+    """
+    cuda = _cuda()
+    if cuda is not None:
+        return sum(cuda.cuda.memory_allocated(i) for i in range(cuda.cuda.device_count()))
+    return _resident_bytes()
+
+
+class PeakMemory:
+    """
+    统计 with 块内的内存峰值: GPU 用 torch 的峰值计数，CPU 每 10ms 采样一次常驻内存
+    """
+
+    def __enter__(self):
+        self.peak = memory_in_use()
+        self._cuda = _cuda()
+        if self._cuda is not None:
+            for index in range(self._cuda.cuda.device_count()):
+                self._cuda.cuda.reset_peak_memory_stats(index)
+        else:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, _resident_bytes())
+
+    def __exit__(self, *exc_info):
+        if self._cuda is not None:
+            self.peak = max(self.peak, sum(
+                self._cuda.cuda.max_memory_allocated(i) for i in range(self._cuda.cuda.device_count())
+            ))
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _resident_bytes())
+
+
+def _is_out_of_memory(error):
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+def _free_memory():
+    gc.collect()
+    cuda = _cuda()
+    if cuda is not None:
+        cuda.cuda.empty_cache()
+
+
+def synthetic_workload(count, seed=0):
+    """
+    生成 count 张模拟版面块的文本行图片（宽高、行数、字号随机但可复现）
+    """
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        font_size = rng.choice((18, 24, 32))
+        lines = rng.randint(1, 4)
+        width = rng.randint(300, 1200)
+        image = Image.new("RGB", (width, lines * font_size * 3 // 2 + 20), "white")
+        draw = ImageDraw.Draw(image)
+        font = ImageFont.load_default(size=font_size)
+        for line in range(lines):
+            text = " ".join(rng.choice(SYNTHETIC_WORDS) for _ in range(width // (font_size * 3)))
+            draw.text((10, 10 + line * font_size * 3 // 2), text, fill="black", font=font)
+        images.append(image)
+    return images
+
+
+class Autotuner:
+    """
+    加载模型时的批大小与并发度（副本数）自动调优
+    先在单个副本上按 1、2、4… 增大批大小，吞吐提升不足 min_gain 或超出内存预算即停止；
+    再按所选批大小逐个增加副本并行推理，直到吞吐不再明显提升或预计超出预算
+    create_replica() 返回一个 transformers 后端的 MinerUClient
+    """
+
+    def __init__(self, create_replica, memory_budget_bytes=None, max_batch_size=16, max_replicas=1,
+                 requests=16, max_new_tokens=32, min_gain=0.05, progress=None):
+        self.create_replica = create_replica
+        self.memory_budget_bytes = memory_budget_bytes or default_memory_budget()
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_replicas = max(1, int(max_replicas))
+        self.requests = max(1, int(requests))
+        self.params = MinerUSamplingParams(max_new_tokens=max_new_tokens)
+        self.min_gain = min_gain
+        self.progress = progress  # progress(说明文字)
+        self.measurements = []
+
+    def _report(self, message):
+        if self.progress is not None:
+            self.progress(message)
+
+    def measure(self, replicas, batch_size):
+        """
+        各副本以 batch_size 并行处理同一份合成负载，返回 (吞吐 请求/秒, 内存峰值)
+        """
+        count = max(self.requests, 2 * batch_size * len(replicas))
+        images = synthetic_workload(count)
+        prompt = DEFAULT_PROMPTS["[default]"]
+        shares = [images[index::len(replicas)] for index in range(len(replicas))]
+        errors = []
+
+        def run(client, share):
+            try:
+                client.client.batch_predict(share, prompt, self.params)
+            except Exception as e:
+                errors.append(e)
+
+        import torch
+        saved_threads = torch.get_num_threads()
+        if _cuda() is None:
+            # 与副本池一致，未显式指定线程数时各副本均分CPU核
+            torch.set_num_threads(configured_intra_op_threads() or max(1, (os.cpu_count() or 1) // len(replicas)))
+        saved = [(client.client.batch_size, client.client.use_tqdm) for client in replicas]
+        try:
+            for client in replicas:
+                client.client.batch_size = batch_size
+                client.client.use_tqdm = False
+            with PeakMemory() as peak:
+                start = time.perf_counter()
+                threads = [threading.Thread(target=run, args=args) for args in zip(replicas, shares)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                seconds = time.perf_counter() - start
+        finally:
+            torch.set_num_threads(saved_threads)
+            for client, (batch, use_tqdm) in zip(replicas, saved):
+                client.client.batch_size = batch
+                client.client.use_tqdm = use_tqdm
+        if errors:
+            raise errors[0]
+        throughput = count / seconds
+        self.measurements.append({
+            "batch_size": batch_size, "replicas": len(replicas),
+            "throughput": round(throughput, 3), "peak_memory_bytes": peak.peak,
+        })
+        self._report(f"批大小 {batch_size}，副本 {len(replicas)}: {throughput:.2f} 请求/秒，内存峰值 {peak.peak / (1 << 30):.2f} GiB")
+        return throughput, peak.peak
+
+    def run(self):
+        """
+        返回 (设置, 调优中已加载的副本列表)，副本可直接交给副本池继续使用
+        """
+        baseline = memory_in_use()
+        replicas = [self.create_replica()]
+        replica_bytes = max(0, memory_in_use() - baseline)
+
+        # 预热一次，排除首次推理的初始化开销
+        replicas[0].client.batch_predict(synthetic_workload(1), DEFAULT_PROMPTS["[default]"], self.params)
+
+        best_batch, best_throughput, best_peak = 1, 0.0, memory_in_use()
+        for batch_size in [size for size in BATCH_SIZE_CANDIDATES if size <= self.max_batch_size]:
+            try:
+                throughput, peak = self.measure(replicas, batch_size)
+            except Exception as e:
+                if not _is_out_of_memory(e):
+                    raise
+                _free_memory()
+                self._report(f"批大小 {batch_size} 内存不足，停止增大")
+                break
+            if peak > self.memory_budget_bytes:
+                self._report(f"批大小 {batch_size} 超出内存预算，停止增大")
+                break
+            if throughput <= best_throughput * (1 + self.min_gain):
+                break
+            best_batch, best_throughput, best_peak = batch_size, throughput, peak
+
+        # 每增加一个副本，预计多占用一份权重和所选批大小下的推理开销
+        per_replica = replica_bytes + max(0, best_peak - baseline - replica_bytes)
+        while len(replicas) < self.max_replicas:
+            if baseline + per_replica * (len(replicas) + 1) > self.memory_budget_bytes:
+                self._report(f"{len(replicas) + 1} 个副本预计超出内存预算")
+                break
+            replicas.append(self.create_replica())
+            try:
+                throughput, peak = self.measure(replicas, best_batch)
+            except Exception as e:
+                if not _is_out_of_memory(e):
+                    raise
+                throughput, peak = 0.0, float("inf")
+            if peak > self.memory_budget_bytes or throughput <= best_throughput * (1 + self.min_gain):
+                replicas.pop()
+                _free_memory()
+                break
+            best_throughput, best_peak = throughput, peak
+
+        settings = {
+            "batch_size": best_batch,
+            "replicas": len(replicas),
+            "throughput": round(best_throughput, 3),
+            "peak_memory_bytes": best_peak,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "measurements": self.measurements,
+            "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        return settings, replicas
+
+
+class AutotuneStore:
+    """
+    调优结果的持久化（JSON 文件），键为 机器指纹/模型路径@修订号[+加载方式]/副本上限/内存预算
+    """
+
+    def __init__(self, path=DEFAULT_AUTOTUNE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_path, variant=None, max_replicas=1, memory_budget_bytes=None):
+        fingerprint, _ = machine_fingerprint()
+        model_path = os.path.abspath(model_path)
+        budget_mib = (memory_budget_bytes or default_memory_budget()) >> 20
+        return (f"{fingerprint}/{model_path}@{model_revision(model_path)}" + (f"+{variant}" if variant else "")
+                + f"/{max(1, int(max_replicas))}r/{budget_mib}MiB")
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def put(self, key, settings):
+        with self._lock:
+            records = self._read()
+            records[key] = {**settings, "machine": machine_fingerprint()[1]}
+            atomic_write_text(self.path, json.dumps(records, ensure_ascii=False, indent=2))
+
+
+def autotune_model(create_replica, model_path, variant=None, store=None, force=False, **tuner_kwargs):
+    """
+    读取本机该模型的调优记录，没有记录（或 force）时运行调优并保存
+    返回 (设置, 调优中已加载的副本列表)；直接使用记录时副本列表为空
+    """
+    store = store or AutotuneStore()
+    # 副本上限和内存预算也是调优的前提，任一变化都重新调优
+    tuner_kwargs["memory_budget_bytes"] = tuner_kwargs.get("memory_budget_bytes") or default_memory_budget()
+    key = store.key(model_path, variant, tuner_kwargs.get("max_replicas", 1), tuner_kwargs["memory_budget_bytes"])
+    settings = None if force else store.get(key)
+    if settings is not None:
+        return settings, []
+    settings, replicas = Autotuner(create_replica, **tuner_kwargs).run()
+    store.put(key, settings)
+    return settings, replicas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自动调优批大小与副本数，并按本机和模型保存结果")
+    parser.add_argument("--model", required=True, help="模型文件夹的绝对路径")
+    parser.add_argument("--cpu-profile", default=None, help="CPU推理配置（见 cpu_profile.py）")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-replicas", type=int, default=1)
+    parser.add_argument("--memory-gb", type=float, default=None, help="内存预算（GiB），缺省见 OCR_AUTOTUNE_MEMORY_GB")
+    parser.add_argument("--requests", type=int, default=16, help="每轮测量的最少请求数")
+    parser.add_argument("--force", action="store_true", help="忽略已有记录重新调优")
+    args = parser.parse_args()
+
+    from mineru_vl_utils import MinerUClient
+    from basic_demo import initialize_model_and_processor
+
+    def create_replica():
+        model, processor = initialize_model_and_processor(args.model, args.cpu_profile)
+        return MinerUClient(backend="transformers", model=model, processor=processor)
+
+    settings, _ = autotune_model(
+        create_replica, args.model, args.cpu_profile, force=args.force,
+        memory_budget_bytes=int(args.memory_gb * (1 << 30)) if args.memory_gb else None,
+        max_batch_size=args.max_batch_size, max_replicas=args.max_replicas, requests=args.requests, progress=print,
+    )
+    print(f"批大小 {settings['batch_size']}，副本数 {settings['replicas']}，吞吐 {settings['throughput']} 请求/秒"
+          f"（{settings['tuned_at']} 测得，记录于 {DEFAULT_AUTOTUNE_PATH}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,19 @@ Copyright (c) 2025 ShatteredCross. All rights reserved.
 """
 from datetime import datetime
 import os
+import time
 import tempfile
 import shutil
 from pathlib import Path
 from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
 from PIL import Image
 from mineru_vl_utils import MinerUClient
+from region_cache import RegionCache, cached_two_step_extract
+from cpu_profile import load_cpu_model
+from remote_backend import build_remote_client, is_remote_spec
+from structured_export import open_exporter
+from image_preprocess import PREPROCESS_STEPS, ImagePreprocessor
+from autotune import autotune_model
 
 # 定义输出时的颜色常量
 YELLOW = '\033[93m'
@@ -59,13 +66,21 @@ def cleanup_temp_files(temp_dir):
         shutil.rmtree(temp_dir)
         print(f"{YELLOW}已清理临时文件: {WHITE}{temp_dir}")
 
-def process_single_image(image_path, client):
+def process_single_image(image_path, client, region_cache=None, preprocessor=None, page_label=None):
     """
-    处理单张图片的OCR
+    处理单张图片的OCR，image_path 也可以是已渲染的页面图像（此时用 page_label 标明来源页）
     """
-    print(f"{YELLOW}正在处理图片: {WHITE}{image_path}")
-    image = Image.open(image_path)
-    extracted_blocks = client.two_step_extract(image)
+    if isinstance(image_path, Image.Image):
+        print(f"{YELLOW}正在处理页面: {WHITE}{page_label or f'{image_path.width}x{image_path.height} 页面图像'}")
+    else:
+        print(f"{YELLOW}正在处理图片: {WHITE}{image_path}")
+    image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+    if preprocessor is not None:
+        image = preprocessor(image)
+    if region_cache is None:
+        extracted_blocks = client.two_step_extract(image)
+    else:
+        extracted_blocks = cached_two_step_extract(client, image, region_cache)
     return extracted_blocks
 
 def save_ocr_results_as_formatted_md(all_extracted_blocks, original_path, multipage=False):
@@ -161,14 +176,17 @@ def process_blocks(blocks):
     return content_lines
 
 
-def initialize_model_and_processor(model_path):
-    """初始化模型和处理器"""
-    model = Qwen2VLForConditionalGeneration.from_pretrained(
-        model_path,
-        local_files_only=True,
-        dtype="auto",
-        device_map="auto"
-    )
+def initialize_model_and_processor(model_path, cpu_profile=None):
+    """初始化模型和处理器，cpu_profile 为CPU推理配置名（见 cpu_profile.py）"""
+    if cpu_profile is None:
+        model = Qwen2VLForConditionalGeneration.from_pretrained(
+            model_path,
+            local_files_only=True,
+            dtype="auto",
+            device_map="auto"
+        )
+    else:
+        model = load_cpu_model(model_path, cpu_profile)
 
     processor = AutoProcessor.from_pretrained(
         model_path,
@@ -181,6 +199,7 @@ def initialize_model_and_processor(model_path):
 def main():
     # -----------------------------------------------------------------
     # 在这里输入【模型文件】存放于本地的绝对路径
+    # 也可输入远程推理服务地址（如 "http://127.0.0.1:30000"，多个地址用逗号分隔），此时不在本地加载模型
     model_path = r"这里放模型文件夹在本地的绝对路径"
     # -----------------------------------------------------------------
     
@@ -189,14 +208,47 @@ def main():
     input_path = r"这里放需要识别的图片或PDF的绝对路径"
     # -----------------------------------------------------------------
     
+    # -----------------------------------------------------------------
+    # 仅CPU环境可选择CPU推理配置: "default"、"int8"、"bf16"、"compile"、"int8-compile"
+    # 保持 None 则按默认方式加载（自动选择设备和精度）
+    cpu_profile = None
+    # -----------------------------------------------------------------
+    
+    # -----------------------------------------------------------------
+    # 可选: 结构化导出文件路径（.jsonl / .parquet / .arrow），逐页写入块记录（页码、类型、bbox、内容、耗时）
+    # 保持 None 则只输出Markdown；Parquet/Arrow 需安装 pyarrow
+    export_path = None
+    # -----------------------------------------------------------------
+    
+    # -----------------------------------------------------------------
+    # 可选: 推理前的图像预处理步骤（手机照片、歪斜扫描件），可选 "crop_border"、"downscale"、"orientation"、"deskew"、"contrast"
+    # 如 preprocess_steps = PREPROCESS_STEPS 启用全部步骤；保持 None 则不做预处理
+    preprocess_steps = None
+    # -----------------------------------------------------------------
+    
+    # -----------------------------------------------------------------
+    # 可选: 加载模型后自动调优推理批大小（首次在合成负载上实测，结果按本机和模型保存，之后直接复用）
+    autotune = False
+    # -----------------------------------------------------------------
+    
     # 初始化模型
-    model, processor = initialize_model_and_processor(model_path)
-    client = MinerUClient(
-        backend="transformers",
-        model=model,
-        processor=processor
-    )
+    if is_remote_spec(model_path):
+        print(f"{GREEN}使用远程推理服务: {WHITE}{model_path}")
+        client = build_remote_client(model_path)
+    else:
+        model, processor = initialize_model_and_processor(model_path, cpu_profile)
+        client = MinerUClient(
+            backend="transformers",
+            model=model,
+            processor=processor
+        )
+        if autotune:
+            settings, _ = autotune_model(lambda: client, model_path, cpu_profile, max_replicas=1, progress=print)
+            client.client.batch_size = settings["batch_size"]
+            print(f"{GREEN}自动调优: 批大小 {settings['batch_size']}")
     
+    exporter = open_exporter(export_path) if export_path else None
+    preprocessor = ImagePreprocessor(preprocess_steps) if preprocess_steps else None
     temp_dir = None
     try:
         # 检查文件类型
@@ -211,11 +263,16 @@ def main():
             # 转换PDF为图片
             image_paths, temp_dir = convert_pdf_to_images(input_path)
             
-            # 处理每一页
+            # 处理每一页，同一文档内复用页眉/页脚的识别结果
+            region_cache = RegionCache()
             all_blocks = []
-            for image_path in image_paths:
-                blocks = process_single_image(image_path, client)
+            for page_num, image_path in enumerate(image_paths, 1):
+                page_start = time.perf_counter()
+                blocks = process_single_image(image_path, client, region_cache, preprocessor)
                 all_blocks.append(blocks)
+                if exporter is not None:
+                    exporter.write_page(blocks, input_path, page_num, time.perf_counter() - page_start)
+            print(f"{YELLOW}区域缓存: 复用页眉/页脚 {region_cache.hits} 次，识别 {region_cache.misses} 次")
             
             # 保存为多页Markdown
             output_path = save_ocr_results_as_formatted_md(all_blocks, input_path, multipage=True)
@@ -223,16 +280,26 @@ def main():
         elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp']:
             print(f"{GREEN}检测到图片文件，开始处理...")
             # 处理单张图片
-            blocks = process_single_image(input_path, client)
+            page_start = time.perf_counter()
+            blocks = process_single_image(input_path, client, preprocessor=preprocessor)
+            if exporter is not None:
+                exporter.write_page(blocks, input_path, 1, time.perf_counter() - page_start)
             output_path = save_ocr_results_as_formatted_md(blocks, input_path, multipage=False)
             
         else:
             print(f"{RED}错误: 不支持的文件格式 {file_ext}")
             return
             
+        if preprocessor is not None:
+            stats = preprocessor.stats()
+            timings = "，".join(f"{step} {item['mean_ms']:.1f}ms" for step, item in stats["steps"].items())
+            print(f"{YELLOW}预处理: 平均每页 {timings}，像素量为原来的 {stats['pixel_ratio']:.0%}")
         print(f"{GREEN}OCR处理完成! 结果保存在: {output_path}")
         
     finally:
+        if exporter is not None:
+            exporter.close()
+            print(f"{GREEN}结构化结果已导出到: {exporter.path}")
         # 清理临时文件
         if temp_dir:
             cleanup_temp_files(temp_dir)
@@ -4,12 +4,19 @@ Copyright (c) 2025 ShatteredCross. All rights reserved.
 """
 from datetime import datetime
 import os
+import time
 import tempfile
 import shutil
 from pathlib import Path
 from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
 from PIL import Image
 from mineru_vl_utils import MinerUClient
+from region_cache import RegionCache, cached_two_step_extract
+from cpu_profile import load_cpu_model
+from remote_backend import build_remote_client, is_remote_spec
+from structured_export import open_exporter
+from image_preprocess import PREPROCESS_STEPS, ImagePreprocessor
+from autotune import autotune_model
 
 # Define color constants for output
 YELLOW = '\033[93m'
@@ -59,13 +66,21 @@ def cleanup_temp_files(temp_dir):
         shutil.rmtree(temp_dir)
         print(f"{YELLOW}Cleaned up temporary files: {WHITE}{temp_dir}")
 
-def process_single_image(image_path, client):
+def process_single_image(image_path, client, region_cache=None, preprocessor=None, page_label=None):
     """
-    Process single image for OCR
+    Process single image for OCR; image_path may also be a rendered page image (page_label then names the source page)
     """
-    print(f"{YELLOW}Processing image: {WHITE}{image_path}")
-    image = Image.open(image_path)
-    extracted_blocks = client.two_step_extract(image)
+    if isinstance(image_path, Image.Image):
+        print(f"{YELLOW}Processing page: {WHITE}{page_label or f'{image_path.width}x{image_path.height} page image'}")
+    else:
+        print(f"{YELLOW}Processing image: {WHITE}{image_path}")
+    image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+    if preprocessor is not None:
+        image = preprocessor(image)
+    if region_cache is None:
+        extracted_blocks = client.two_step_extract(image)
+    else:
+        extracted_blocks = cached_two_step_extract(client, image, region_cache)
     return extracted_blocks
 
 def save_ocr_results_as_formatted_md(all_extracted_blocks, original_path, multipage=False):
@@ -161,14 +176,17 @@ def process_blocks(blocks):
     return content_lines
 
 
-def initialize_model_and_processor(model_path):
-    """Initialize model and processor"""
-    model = Qwen2VLForConditionalGeneration.from_pretrained(
-        model_path,
-        local_files_only=True,
-        dtype="auto",
-        device_map="auto"
-    )
+def initialize_model_and_processor(model_path, cpu_profile=None):
+    """Initialize model and processor, cpu_profile is a CPU inference profile name (see cpu_profile.py)"""
+    if cpu_profile is None:
+        model = Qwen2VLForConditionalGeneration.from_pretrained(
+            model_path,
+            local_files_only=True,
+            dtype="auto",
+            device_map="auto"
+        )
+    else:
+        model = load_cpu_model(model_path, cpu_profile)
 
     processor = AutoProcessor.from_pretrained(
         model_path,
@@ -181,6 +199,7 @@ def initialize_model_and_processor(model_path):
 def main():
     # -----------------------------------------------------------------
     # Enter the absolute path to the model directory here
+    # Remote inference server URLs are also accepted (e.g. "http://127.0.0.1:30000", comma-separated for several); no model is loaded locally then
     model_path = r"Enter the absolute path to the model directory here"
     # -----------------------------------------------------------------
     
@@ -189,14 +208,47 @@ def main():
     input_path = r"Enter the absolute path to the image or PDF file to be recognized here"
     # -----------------------------------------------------------------
     
+    # -----------------------------------------------------------------
+    # CPU-only environments can choose a CPU inference profile: "default", "int8", "bf16", "compile", "int8-compile"
+    # Keep None to load the default way (automatic device and precision)
+    cpu_profile = None
+    # -----------------------------------------------------------------
+    
+    # -----------------------------------------------------------------
+    # Optional: structured export file path (.jsonl / .parquet / .arrow), block records (page, type, bbox, content, timing) are written page by page
+    # Keep None to output Markdown only; Parquet/Arrow requires pyarrow
+    export_path = None
+    # -----------------------------------------------------------------
+    
+    # -----------------------------------------------------------------
+    # Optional: image preprocessing steps before inference (phone photos, skewed scans): "crop_border", "downscale", "orientation", "deskew", "contrast"
+    # e.g. preprocess_steps = PREPROCESS_STEPS enables all steps; keep None to skip preprocessing
+    preprocess_steps = None
+    # -----------------------------------------------------------------
+    
+    # -----------------------------------------------------------------
+    # Optional: autotune the inference batch size after loading the model (measured on a synthetic workload the first time, saved per machine and model and reused afterwards)
+    autotune = False
+    # -----------------------------------------------------------------
+    
     # Initialize model
-    model, processor = initialize_model_and_processor(model_path)
-    client = MinerUClient(
-        backend="transformers",
-        model=model,
-        processor=processor
-    )
+    if is_remote_spec(model_path):
+        print(f"{GREEN}Using remote inference servers: {WHITE}{model_path}")
+        client = build_remote_client(model_path)
+    else:
+        model, processor = initialize_model_and_processor(model_path, cpu_profile)
+        client = MinerUClient(
+            backend="transformers",
+            model=model,
+            processor=processor
+        )
+        if autotune:
+            settings, _ = autotune_model(lambda: client, model_path, cpu_profile, max_replicas=1, progress=print)
+            client.client.batch_size = settings["batch_size"]
+            print(f"{GREEN}Autotune: batch size {settings['batch_size']}")
     
+    exporter = open_exporter(export_path) if export_path else None
+    preprocessor = ImagePreprocessor(preprocess_steps) if preprocess_steps else None
     temp_dir = None
     try:
         # Check file type
@@ -211,11 +263,16 @@ def main():
             # Convert PDF to images
             image_paths, temp_dir = convert_pdf_to_images(input_path)
             
-            # Process each page
+            # Process each page, reusing header/footer recognition results within the document
+            region_cache = RegionCache()
             all_blocks = []
-            for image_path in image_paths:
-                blocks = process_single_image(image_path, client)
+            for page_num, image_path in enumerate(image_paths, 1):
+                page_start = time.perf_counter()
+                blocks = process_single_image(image_path, client, region_cache, preprocessor)
                 all_blocks.append(blocks)
+                if exporter is not None:
+                    exporter.write_page(blocks, input_path, page_num, time.perf_counter() - page_start)
+            print(f"{YELLOW}Region cache: reused headers/footers {region_cache.hits} times, recognized {region_cache.misses} times")
             
             # Save as multi-page Markdown
             output_path = save_ocr_results_as_formatted_md(all_blocks, input_path, multipage=True)
@@ -223,16 +280,26 @@ def main():
         elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp']:
             print(f"{GREEN}Image file detected, starting processing...")
             # Process single image
-            blocks = process_single_image(input_path, client)
+            page_start = time.perf_counter()
+            blocks = process_single_image(input_path, client, preprocessor=preprocessor)
+            if exporter is not None:
+                exporter.write_page(blocks, input_path, 1, time.perf_counter() - page_start)
             output_path = save_ocr_results_as_formatted_md(blocks, input_path, multipage=False)
             
         else:
             print(f"{RED}Error: Unsupported file format {file_ext}")
             return
             
+        if preprocessor is not None:
+            stats = preprocessor.stats()
+            timings = ", ".join(f"{step} {item['mean_ms']:.1f}ms" for step, item in stats["steps"].items())
+            print(f"{YELLOW}Preprocessing: per page {timings}, {stats['pixel_ratio']:.0%} of the original pixels")
         print(f"{GREEN}OCR processing completed! Results saved to: {output_path}")
         
     finally:
+        if exporter is not None:
+            exporter.close()
+            print(f"{GREEN}Structured results exported to: {exporter.path}")
         # Clean up temporary files
         if temp_dir:
             cleanup_temp_files(temp_dir)
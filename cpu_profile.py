@@ -0,0 +1,142 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import difflib
+import gc
+import os
+import time
+from PIL import Image
+from transformers import Qwen2VLForConditionalGeneration
+
+# CPU 推理配置:
+#   quantize: 对线性层做动态 int8 量化（需以 float32 加载）
+#   bf16: CPU 支持 bf16 指令时以 bfloat16 推理，否则退回 float32
+#   compile: 使用 torch.compile 编译前向计算
+CPU_PROFILES = {
+    "default": {},
+    "int8": {"quantize": True},
+    "bf16": {"bf16": True},
+    "compile": {"compile": True},
+    "int8-compile": {"quantize": True, "compile": True},
+}
+
+
+def bf16_supported():
+    """
+    检测CPU是否支持 bf16 加速（AVX512-BF16 / AMX）
+    """
+    import torch
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configured_intra_op_threads():
+    """
+    OCR_INTRA_OP_THREADS 显式指定的算子内线程数，未指定时为 0
+    """
+    return int(os.environ.get("OCR_INTRA_OP_THREADS", 0))
+
+
+def set_thread_counts(intra_op_threads=None, inter_op_threads=None):
+    """
+    设置 torch 算子内/算子间线程数，未指定时读取 OCR_INTRA_OP_THREADS / OCR_INTER_OP_THREADS
+    """
+    import torch
+    intra_op_threads = intra_op_threads or configured_intra_op_threads()
+    inter_op_threads = inter_op_threads or int(os.environ.get("OCR_INTER_OP_THREADS", 0))
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # 算子间线程池在首次并行计算后不可再修改
+            pass
+
+
+def load_cpu_model(model_path, profile="default"):
+    """
+    按CPU推理配置加载模型
+    """
+    import torch
+    if profile not in CPU_PROFILES:
+        raise ValueError(f"未知的CPU推理配置: {profile}，可选: {', '.join(CPU_PROFILES)}")
+    options = CPU_PROFILES[profile]
+    set_thread_counts()
+
+    if options.get("quantize"):
+        dtype = torch.float32
+    elif options.get("bf16") and bf16_supported():
+        dtype = torch.bfloat16
+    elif options.get("bf16"):
+        print(f"当前CPU不支持 bf16 加速，配置 {profile} 退回 float32")
+        dtype = torch.float32
+    else:
+        dtype = "auto"
+
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        model_path,
+        local_files_only=True,
+        dtype=dtype,
+        device_map="cpu"
+    )
+    model.eval()
+
+    if options.get("quantize"):
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if options.get("compile"):
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+
+def calibrate(model_path, sample_image, profiles=None, warmup_runs=1):
+    """
+    在样例页面上对比各CPU推理配置相对 default 的速度提升和输出偏差
+    返回 [(配置名, 耗时秒, 加速比, 输出偏差)]，偏差为 1 - 文本相似度
+    """
+    from transformers import AutoProcessor
+    from mineru_vl_utils import MinerUClient
+
+    profiles = ["default"] + [name for name in (profiles or CPU_PROFILES) if name != "default"]
+    image = Image.open(sample_image)
+    processor = AutoProcessor.from_pretrained(model_path, use_fast=True)
+
+    results = []
+    baseline_seconds = baseline_text = None
+    for name in profiles:
+        model = load_cpu_model(model_path, name)
+        client = MinerUClient(backend="transformers", model=model, processor=processor, use_tqdm=False)
+        # torch.compile 首次运行包含编译开销，预热后再计时
+        for _ in range(warmup_runs if CPU_PROFILES[name].get("compile") else 0):
+            client.two_step_extract(image)
+        start = time.perf_counter()
+        blocks = client.two_step_extract(image)
+        seconds = time.perf_counter() - start
+        text = "\n".join(block.get("content") or "" for block in blocks)
+
+        if baseline_text is None:
+            baseline_seconds, baseline_text = seconds, text
+        drift = 1 - difflib.SequenceMatcher(None, baseline_text, text).ratio()
+        results.append((name, seconds, baseline_seconds / seconds, drift))
+        print(f"{name:<14} 耗时 {seconds:8.2f}s  加速比 {baseline_seconds / seconds:5.2f}x  输出偏差 {drift:6.2%}")
+
+        del client, model
+        gc.collect()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU推理配置校准: 对比各配置的速度与输出偏差")
+    parser.add_argument("--model", required=True, help="模型文件夹的绝对路径")
+    parser.add_argument("--image", required=True, help="用于校准的样例页面图片")
+    parser.add_argument("--profiles", default=",".join(CPU_PROFILES), help="逗号分隔的配置名")
+    args = parser.parse_args()
+    calibrate(args.model, args.image, args.profiles.split(","))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from PIL import Image
+
+from job_scheduler import document_page_count, render_pdf_page
+
+SUPPORTED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".bmp")
+
+
+def file_digest(file_path):
+    """
+    文件内容的 sha1，作为文档ID；同一文件重复提交不会产生新任务
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PageTask:
+    __slots__ = ("task_id", "doc_id", "source_path", "page_index", "attempts")
+
+    def __init__(self, task_id, doc_id, source_path, page_index, attempts):
+        self.task_id = task_id
+        self.doc_id = doc_id
+        self.source_path = source_path
+        self.page_index = page_index
+        self.attempts = attempts
+
+
+class TaskQueue(ABC):
+    """
+    页任务队列接口，协调器和工作进程只依赖这些方法，可替换为其他持久化实现
+    """
+
+    @abstractmethod
+    def add_document(self, doc_id, source_path, page_count):
+        """登记文档并为每页创建任务；已存在且失败的文档重置失败页后重新排队，其余已存在的文档返回 False"""
+
+    @abstractmethod
+    def lease(self, worker_id, lease_seconds):
+        """领取一个待处理（或租约已过期）的页任务，没有时返回 None"""
+
+    @abstractmethod
+    def extend(self, task, worker_id, lease_seconds):
+        """续租，任务已不属于该工作进程时返回 False"""
+
+    @abstractmethod
+    def complete(self, task, worker_id, blocks):
+        """提交页面识别结果"""
+
+    @abstractmethod
+    def fail(self, task, worker_id, error):
+        """报告失败，未超过最大尝试次数的任务退避后重新排队"""
+
+    @abstractmethod
+    def finished_documents(self):
+        """所有页面都已结束（完成或彻底失败）但尚未汇总的文档: [(文档ID, 源文件, 是否有失败页)]"""
+
+    @abstractmethod
+    def page_results(self, doc_id):
+        """按页序返回文档各页的识别块"""
+
+    @abstractmethod
+    def mark_document(self, doc_id, status, output_path=None):
+        """记录文档汇总结果: assembled / failed"""
+
+    @abstractmethod
+    def stats(self):
+        """任务和文档按状态计数"""
+
+
+class SQLiteTaskQueue(TaskQueue):
+    """
+    基于 SQLite 的持久化页任务队列，多个进程（含共享存储上的多个节点）可共享同一个数据库文件
+    使用回滚日志而非 WAL（WAL 依赖单机共享内存，在网络文件系统上不可用），依靠文件锁互斥；
+    领取任务在 IMMEDIATE 事务中完成，同一任务不会被两个工作进程同时持有
+    """
+
+    def __init__(self, db_path, max_attempts=3, retry_backoff_seconds=5):
+        self.db_path = db_path
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_backoff_seconds = retry_backoff_seconds
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    source_path TEXT NOT NULL,
+                    page_count INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    output_path TEXT,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    doc_id TEXT NOT NULL REFERENCES documents(doc_id),
+                    page_index INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    result TEXT,
+                    error TEXT,
+                    UNIQUE (doc_id, page_index)
+                );
+                CREATE INDEX IF NOT EXISTS tasks_status ON tasks(status, available_at);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作使用独立连接，便于多线程共享同一个队列对象
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def add_document(self, doc_id, source_path, page_count):
+        with self._transaction() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO documents (doc_id, source_path, page_count, created_at) VALUES (?, ?, ?, ?)",
+                (doc_id, source_path, page_count, time.time()),
+            ).rowcount
+            if inserted:
+                conn.executemany(
+                    "INSERT INTO tasks (doc_id, page_index) VALUES (?, ?)",
+                    [(doc_id, page_index) for page_index in range(page_count)],
+                )
+                return True
+            # 之前因失败页而判为失败的文档再次提交时，只重试失败的页面，已完成的页面保留
+            retried = conn.execute(
+                "UPDATE documents SET status = 'pending', source_path = ?, output_path = NULL "
+                "WHERE doc_id = ? AND status = 'failed'",
+                (source_path, doc_id),
+            ).rowcount
+            if retried:
+                conn.execute(
+                    "UPDATE tasks SET status = 'pending', attempts = 0, available_at = 0, error = NULL, "
+                    "  lease_owner = NULL, lease_expires = NULL "
+                    "WHERE doc_id = ? AND status = 'failed'",
+                    (doc_id,),
+                )
+        return bool(retried)
+
+    def lease(self, worker_id, lease_seconds):
+        now = time.time()
+        with self._transaction() as conn:
+            # 租约过期且已用完尝试次数的任务（工作进程多次崩溃）直接判为失败
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', error = 'lease expired', lease_owner = NULL "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT t.task_id, t.doc_id, d.source_path, t.page_index, t.attempts "
+                "FROM tasks t JOIN documents d ON d.doc_id = t.doc_id "
+                "WHERE (t.status = 'pending' AND t.available_at <= ?) "
+                "   OR (t.status = 'leased' AND t.lease_expires < ?) "
+                "ORDER BY t.task_id LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_expires = ? "
+                "WHERE task_id = ?",
+                (worker_id, now + lease_seconds, row[0]),
+            )
+        task_id, doc_id, source_path, page_index, attempts = row
+        return PageTask(task_id, doc_id, source_path, page_index, attempts + 1)
+
+    def extend(self, task, worker_id, lease_seconds):
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time() + lease_seconds, task.task_id, worker_id),
+            ).rowcount == 1
+
+    def complete(self, task, worker_id, blocks):
+        # 租约过期后被他人重新领取的任务，先完成的结果有效
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, error = NULL, lease_owner = NULL, lease_expires = NULL "
+                "WHERE task_id = ? AND status != 'done'",
+                (json.dumps(blocks, ensure_ascii=False, default=str), task.task_id),
+            )
+
+    def fail(self, task, worker_id, error):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET "
+                "  status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "  available_at = ?, error = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE task_id = ? AND status = 'leased' AND lease_owner = ?",
+                (
+                    self.max_attempts,
+                    time.time() + self.retry_backoff_seconds * 2 ** (task.attempts - 1),
+                    str(error),
+                    task.task_id,
+                    worker_id,
+                ),
+            )
+
+    def finished_documents(self):
+        with self._connect() as conn:
+            return [
+                (doc_id, source_path, bool(has_failed))
+                for doc_id, source_path, has_failed in conn.execute(
+                    "SELECT d.doc_id, d.source_path, "
+                    "  EXISTS (SELECT 1 FROM tasks t WHERE t.doc_id = d.doc_id AND t.status = 'failed') "
+                    "FROM documents d WHERE d.status = 'pending' AND NOT EXISTS ("
+                    "  SELECT 1 FROM tasks t WHERE t.doc_id = d.doc_id AND t.status NOT IN ('done', 'failed')"
+                    ") ORDER BY d.created_at"
+                )
+            ]
+
+    def page_results(self, doc_id):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT result FROM tasks WHERE doc_id = ? ORDER BY page_index", (doc_id,)
+            ).fetchall()
+        return [json.loads(result) if result is not None else [] for result, in rows]
+
+    def mark_document(self, doc_id, status, output_path=None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE documents SET status = ?, output_path = ? WHERE doc_id = ?", (status, output_path, doc_id)
+            )
+
+    def stats(self):
+        with self._connect() as conn:
+            return {
+                "tasks": dict(conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()),
+                "documents": dict(conn.execute("SELECT status, COUNT(*) FROM documents GROUP BY status").fetchall()),
+            }
+
+
+def collect_input_files(paths):
+    """
+    展开输入路径（文件或目录）为支持的文档列表
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+    return [os.path.abspath(path) for path in files if os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS]
+
+
+class Coordinator:
+    """
+    协调器: 把文档拆成页任务放入队列，并在文档所有页面完成后汇总为 Markdown
+    源文件路径需对所有工作节点可见（如共享存储）
+    """
+
+    def __init__(self, task_queue):
+        self.queue = task_queue
+
+    def submit(self, paths):
+        """
+        提交文档，返回新加入（或失败后重新排队）的文档数
+        """
+        added = 0
+        for file_path in collect_input_files(paths):
+            page_count = document_page_count(file_path)
+            if self.queue.add_document(file_digest(file_path), file_path, page_count):
+                added += 1
+        return added
+
+    def assemble_finished(self):
+        """
+        汇总已完成的文档，返回 [(源文件, 输出路径或 None)]
+        """
+        from basic_demo import save_ocr_results_as_formatted_md
+
+        assembled = []
+        for doc_id, source_path, has_failed in self.queue.finished_documents():
+            if has_failed:
+                self.queue.mark_document(doc_id, "failed")
+                assembled.append((source_path, None))
+                continue
+            pages = self.queue.page_results(doc_id)
+            if os.path.splitext(source_path)[1].lower() == ".pdf":
+                output_path = save_ocr_results_as_formatted_md(pages, source_path, multipage=True)
+            else:
+                output_path = save_ocr_results_as_formatted_md(pages[0], source_path, multipage=False)
+            self.queue.mark_document(doc_id, "assembled", output_path)
+            assembled.append((source_path, output_path))
+        return assembled
+
+    def run(self, poll_interval=5):
+        """
+        持续汇总，直到队列中没有未结束的文档
+        """
+        while True:
+            for source_path, output_path in self.assemble_finished():
+                print(f"{'已汇总' if output_path else '识别失败'}: {source_path}" + (f" -> {output_path}" if output_path else ""))
+            if not self.queue.stats()["documents"].get("pending"):
+                return
+            time.sleep(poll_interval)
+
+
+class Worker:
+    """
+    无状态工作进程: 领取页任务、识别并提交结果；处理期间后台续租，崩溃的工作进程的任务在租约过期后由他人接手
+    """
+
+    def __init__(self, task_queue, client, worker_id=None, lease_seconds=300):
+        self.queue = task_queue
+        self.client = client
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.processed = 0
+        self.failed = 0
+
+    def _load_page(self, task):
+        if os.path.splitext(task.source_path)[1].lower() == ".pdf":
+            return render_pdf_page(task.source_path, task.page_index + 1)
+        return Image.open(task.source_path)
+
+    def run_task(self, task):
+        from basic_demo import process_single_image
+
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(self.lease_seconds / 3):
+                if not self.queue.extend(task, self.worker_id, self.lease_seconds):
+                    return
+
+        thread = threading.Thread(target=heartbeat, name="lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            blocks = process_single_image(
+                self._load_page(task), self.client,
+                page_label=f"{os.path.basename(task.source_path)} 第 {task.page_index + 1} 页",
+            )
+        except Exception as e:
+            self.queue.fail(task, self.worker_id, e)
+            self.failed += 1
+        else:
+            self.queue.complete(task, self.worker_id, blocks)
+            self.processed += 1
+        finally:
+            stop_heartbeat.set()
+            thread.join()
+
+    def run(self, poll_interval=2, exit_when_idle=False):
+        while True:
+            task = self.queue.lease(self.worker_id, self.lease_seconds)
+            if task is not None:
+                self.run_task(task)
+                continue
+            if exit_when_idle:
+                counts = self.queue.stats()["tasks"]
+                if not counts.get("pending") and not counts.get("leased"):
+                    return
+            time.sleep(poll_interval)
+
+
+def load_client(model_path, cpu_profile=None):
+    """
+    工作进程的推理客户端: 本地模型目录或远程推理端点
+    """
+    from remote_backend import build_remote_client, is_remote_spec
+
+    if is_remote_spec(model_path):
+        return build_remote_client(model_path)
+    from mineru_vl_utils import MinerUClient
+    from basic_demo import initialize_model_and_processor
+    model, processor = initialize_model_and_processor(model_path, cpu_profile)
+    return MinerUClient(backend="transformers", model=model, processor=processor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式批量OCR: 协调器拆分页任务，工作进程并行识别")
+    parser.add_argument("--queue", default="ocr_queue.db", help="SQLite 队列文件（多节点时放在共享存储上）")
+    parser.add_argument("--max-attempts", type=int, default=3, help="每页最多尝试次数")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="提交文档（文件或目录）")
+    submit_parser.add_argument("paths", nargs="+")
+    submit_parser.add_argument("--wait", action="store_true", help="提交后持续汇总直到全部完成")
+
+    subparsers.add_parser("assemble", help="持续汇总已完成的文档直到队列清空")
+
+    worker_parser = subparsers.add_parser("worker", help="启动工作进程")
+    worker_parser.add_argument("--model", required=True, help="模型文件夹路径或远程推理端点地址")
+    worker_parser.add_argument("--cpu-profile", default=None, help="CPU推理配置（见 cpu_profile.py）")
+    worker_parser.add_argument("--lease-seconds", type=float, default=300)
+    worker_parser.add_argument("--exit-when-idle", action="store_true", help="队列为空时退出")
+
+    subparsers.add_parser("status", help="查看队列状态")
+    args = parser.parse_args()
+
+    task_queue = SQLiteTaskQueue(args.queue, max_attempts=args.max_attempts)
+    if args.role == "submit":
+        coordinator = Coordinator(task_queue)
+        print(f"新增文档: {coordinator.submit(args.paths)}")
+        if args.wait:
+            coordinator.run()
+    elif args.role == "assemble":
+        Coordinator(task_queue).run()
+    elif args.role == "worker":
+        worker = Worker(task_queue, load_client(args.model, args.cpu_profile), lease_seconds=args.lease_seconds)
+        print(f"工作进程 {worker.worker_id} 已启动")
+        worker.run(exit_when_idle=args.exit_when_idle)
+        print(f"工作进程退出: 完成 {worker.processed} 页，失败 {worker.failed} 次")
+    else:
+        print(json.dumps(task_queue.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
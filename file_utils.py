@@ -0,0 +1,25 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import os
+import tempfile
+
+
+def atomic_write_text(file_path, content):
+    """
+    先写入同目录的临时文件再原子替换，读取方不会看到写了一半的结果
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,342 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import os
+import threading
+import time
+import numpy as np
+from PIL import Image
+
+# 预处理步骤。各步骤只在同一张缩略图上做分析、得出裁剪框/缩放比例/方向/倾角/亮度映射，
+# 最后对原图只做一次重采样（裁剪、缩放、转正、纠偏合成一个变换），再在缩小后的图像上应用亮度查找表
+PREPROCESS_STEPS = ("crop_border", "downscale", "orientation", "deskew", "contrast")
+
+# EXIF 方向标记对应的转置操作（同 ImageOps.exif_transpose）
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# 转正后坐标 (x, y) 到原图坐标的映射 (x', y') = (ax + by + c·W, dx + ey + f·H)，W/H 为原图宽高
+EXIF_INVERSE = {
+    2: (-1, 0, 1, 0, 1, 0),
+    3: (-1, 0, 1, 0, -1, 1),
+    4: (1, 0, 0, 0, -1, 1),
+    5: (0, 1, 0, 1, 0, 0),
+    6: (0, 1, 0, -1, 0, 1),
+    7: (0, -1, 1, -1, 0, 1),
+    8: (0, -1, 1, 1, 0, 0),
+}
+
+# 分析（背景、倾角、直方图）用的缩略图长边，像素操作最后一次性作用于原图
+ANALYSIS_SIDE = 800
+
+# 扫描件纠偏的搜索范围（度），先按 1 度粗搜再在最优角附近按 0.1 度细搜；小于 DESKEW_MIN_ANGLE 的倾斜不做旋转
+DESKEW_MAX_ANGLE = 8.0
+DESKEW_MIN_ANGLE = 0.3
+
+# 参与倾角估计的前景像素上限，超出时等间隔抽样
+DESKEW_MAX_POINTS = 10000
+
+
+def _analysis_image(image):
+    """
+    用整数倍 reduce 得到灰度缩略图（box 采样，比 resize 快得多）
+    """
+    factor = max(1, max(image.size) // ANALYSIS_SIDE)
+    thumb = image.reduce(factor) if factor > 1 else image
+    return thumb.convert("L"), factor
+
+
+def _background_level(gray):
+    # 取四周一圈像素的中位数作为背景亮度
+    frame = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+    return int(np.median(frame))
+
+
+def _percentiles(gray, *percents):
+    # 由 256 级直方图求灰度百分位，比 np.percentile 排序快
+    cumulative = np.cumsum(np.bincount(gray.ravel(), minlength=256)) / gray.size
+    return [int(np.searchsorted(cumulative, percent / 100)) for percent in percents]
+
+
+def exif_orientation(image):
+    return image.getexif().get(0x0112, 1) or 1
+
+
+def find_border(gray, threshold=40, margin=0.01, min_gain=0.02):
+    """
+    在灰度缩略图上找出内容区域 (left, top, right, bottom)，无需裁剪时返回 None
+    只有四周背景与页面中部的纸面明显不同（扫描黑边、拍照时的桌面等）才裁剪，干净扫描件的白边保留，
+    识别块的 bbox 仍相对于原页面
+    前景判定: 与背景亮度差超过 threshold；行/列中前景像素占比不足 0.5% 视为噪点
+    """
+    background = _background_level(gray)
+    height, width = gray.shape
+    paper = _percentiles(gray[height // 4:height * 3 // 4, width // 4:width * 3 // 4], 50)[0]
+    if abs(paper - background) <= threshold:
+        return None
+    mask = np.abs(gray - background) > threshold
+    rows = np.flatnonzero(mask.sum(axis=1) > max(2, width * 0.005))
+    cols = np.flatnonzero(mask.sum(axis=0) > max(2, height * 0.005))
+    if rows.size == 0 or cols.size == 0:
+        return None
+    pad_y = int(height * margin) + 1
+    pad_x = int(width * margin) + 1
+    box = (max(0, cols[0] - pad_x), max(0, rows[0] - pad_y), min(width, cols[-1] + 1 + pad_x), min(height, rows[-1] + 1 + pad_y))
+    # 裁剪收益太小时保持原样
+    if (box[2] - box[0]) * (box[3] - box[1]) > width * height * (1 - min_gain):
+        return None
+    return box
+
+
+def _projection_scores(ys, xs, angles):
+    # 每个角度下各点旋转后的纵坐标，形状 (角度数, 点数)；各角度的行投影直方图用一次 bincount 得到
+    radians = np.deg2rad(angles)
+    projected = ys[None, :] * np.cos(radians)[:, None] + xs[None, :] * np.sin(radians)[:, None]
+    bins = np.round(projected).astype(np.int64)
+    bins -= bins.min()
+    n_bins = int(bins.max()) + 1
+    offsets = (np.arange(len(angles)) * n_bins)[:, None]
+    histograms = np.bincount((bins + offsets).ravel(), minlength=len(angles) * n_bins).reshape(len(angles), n_bins)
+    return (histograms.astype(np.float64) ** 2).sum(axis=1)
+
+
+def estimate_skew(gray):
+    """
+    投影法估计文本行倾角（度，正值为逆时针倾斜）
+    文本行与行间空白对齐时行投影直方图最“尖锐”（平方和最大）
+    """
+    # 以中位灰度（通常是纸面）为准，明显更暗的像素视为文字
+    ys, xs = np.nonzero(gray < _percentiles(gray, 50)[0] - 60)
+    if ys.size < 50:
+        return 0.0
+    if ys.size > DESKEW_MAX_POINTS:
+        step = ys.size // DESKEW_MAX_POINTS + 1
+        ys, xs = ys[::step], xs[::step]
+    ys = ys.astype(np.float32)
+    xs = xs.astype(np.float32) - gray.shape[1] / 2
+    coarse = np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + 0.5, 1.0)
+    best = coarse[int(np.argmax(_projection_scores(ys, xs, coarse)))]
+    fine = np.arange(best - 1.0, best + 1.05, 0.1)
+    return float(np.round(fine[int(np.argmax(_projection_scores(ys, xs, fine)))], 1))
+
+
+def contrast_lut(gray, low_percent=1.0, high_percent=99.0):
+    """
+    按灰度直方图的百分位线性拉伸亮度（发灰、偏暗的照片和扫描件）的查找表，已接近满幅或几乎是纯色时返回 None
+    """
+    low, high = _percentiles(gray, low_percent, high_percent)
+    if (low <= 8 and high >= 247) or high - low < 32:
+        return None
+    return np.clip((np.arange(256) - low) * 255.0 / (high - low), 0, 255).astype(np.uint8).tolist()
+
+
+def render(image, box=None, scale=1.0, orientation=1, angle=0.0, fill=255):
+    """
+    对原图做一次重采样: 裁剪到 box（转正后坐标），按 scale 缩放，按 EXIF 方向转正，再旋转 -angle 度纠偏
+    """
+    source_width, source_height = image.size
+    oriented = (source_height, source_width) if orientation in (5, 6, 7, 8) else (source_width, source_height)
+    left, top, right, bottom = box or (0, 0, *oriented)
+    if not angle:
+        # 没有旋转时裁剪缩放用面积平均（box）一次完成，转正在缩小后的图像上做，都是精确的像素操作
+        if orientation in EXIF_TRANSPOSE:
+            a, b, c, d, e, f = EXIF_INVERSE[orientation]
+            corners = [(a * x + b * y + c * source_width, d * x + e * y + f * source_height) for x, y in ((left, top), (right, bottom))]
+            source_box = (min(x for x, _ in corners), min(y for _, y in corners), max(x for x, _ in corners), max(y for _, y in corners))
+        else:
+            source_box = (left, top, right, bottom)
+        size = (max(1, round((source_box[2] - source_box[0]) * scale)), max(1, round((source_box[3] - source_box[1]) * scale)))
+        if source_box != (0, 0, source_width, source_height) or size != image.size:
+            image = image.resize(size, Image.Resampling.BOX, box=source_box)
+        return image.transpose(EXIF_TRANSPOSE[orientation]) if orientation in EXIF_TRANSPOSE else image
+
+    # 有旋转时合成一个仿射变换，按 2 倍密度最近邻采样后 2x2 平均（比双线性插值快，且同样平滑）
+    # 大幅缩小时先整数倍 reduce，避免采样间隔大于一个像素产生锯齿
+    reduce_factor = max(1, int(1 / scale))
+    if reduce_factor > 1:
+        image = image.reduce(reduce_factor)
+    radians = np.deg2rad(angle)
+    cos, sin = float(np.cos(radians)), float(np.sin(radians))
+    width, height = (right - left) * scale, (bottom - top) * scale
+    out_size = (max(1, round(abs(width * cos) + abs(height * sin))) * 2, max(1, round(abs(width * sin) + abs(height * cos))) * 2)
+    # 输出坐标 -> 转正后的原图坐标: 绕中心逆旋转后除以缩放比例
+    center_x, center_y = (left + right) / 2, (top + bottom) / 2
+    m = (cos / scale / 2, sin / scale / 2, -sin / scale / 2, cos / scale / 2)
+    matrix = [m[0], m[1], center_x - m[0] * out_size[0] / 2 - m[1] * out_size[1] / 2,
+              m[2], m[3], center_y - m[2] * out_size[0] / 2 - m[3] * out_size[1] / 2]
+    # 转正后坐标 -> 原图坐标，再换算到 reduce 后的坐标
+    a, b, c, d, e, f = EXIF_INVERSE.get(orientation, (1, 0, 0, 0, 1, 0))
+    matrix = [
+        (a * matrix[0] + b * matrix[3]) / reduce_factor,
+        (a * matrix[1] + b * matrix[4]) / reduce_factor,
+        (a * matrix[2] + b * matrix[5] + c * source_width) / reduce_factor,
+        (d * matrix[0] + e * matrix[3]) / reduce_factor,
+        (d * matrix[1] + e * matrix[4]) / reduce_factor,
+        (d * matrix[2] + e * matrix[5] + f * source_height) / reduce_factor,
+    ]
+    fillcolor = fill if image.mode == "L" else (fill,) * len(image.getbands())
+    return image.transform(out_size, Image.Transform.AFFINE, matrix, Image.Resampling.NEAREST, fillcolor=fillcolor).reduce(2)
+
+
+class ImagePreprocessor:
+    """
+    可选的推理前图像预处理，每个步骤可单独开关并记录耗时
+    处理后的图像即为识别所用的页面，识别块的 bbox 也相对于处理后的图像
+    """
+
+    def __init__(self, steps=PREPROCESS_STEPS, max_side=2400):
+        unknown = set(steps) - set(PREPROCESS_STEPS)
+        if unknown:
+            raise ValueError(f"未知的预处理步骤: {', '.join(sorted(unknown))}，可选: {', '.join(PREPROCESS_STEPS)}")
+        self.steps = tuple(step for step in PREPROCESS_STEPS if step in steps)
+        self.max_side = max_side
+        self._lock = threading.Lock()
+        # 各步骤只记分析耗时，缩略图生成和最终的一次重采样记在 resample 下
+        self._stats = {step: {"calls": 0, "applied": 0, "seconds": 0.0} for step in self.steps + ("resample",)}
+        self._images = 0
+        self._pixels_in = 0
+        self._pixels_out = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        OCR_PREPROCESS: 逗号分隔的步骤名，"all" 表示全部，缺省不做预处理
+        OCR_PREPROCESS_MAX_SIDE: 缩放后的最大长边
+        """
+        spec = os.environ.get("OCR_PREPROCESS", "").strip()
+        steps = PREPROCESS_STEPS if spec == "all" else [step.strip() for step in spec.split(",") if step.strip()]
+        return cls(steps, max_side=int(os.environ.get("OCR_PREPROCESS_MAX_SIDE", 2400)))
+
+    @property
+    def enabled(self):
+        return bool(self.steps)
+
+    def process(self, image):
+        """
+        依次分析启用的步骤并一次性重采样，返回 (处理后的图像, {步骤: (是否生效, 耗时秒)})，含 resample 项
+        """
+        pixels_in = image.width * image.height
+        report = {}
+        orientation = exif_orientation(image) if "orientation" in self.steps else 1
+        if orientation not in EXIF_TRANSPOSE:
+            orientation = 1
+        if "downscale" in self.steps and image.format == "JPEG":
+            # 尚未解码的 JPEG 直接按 1/2、1/4、1/8 缩放解码（已解码时无效果）
+            scale = min(1.0, self.max_side / max(image.size))
+            image.draft("RGB", (round(image.width * scale), round(image.height * scale)))
+        # 解码不计入各步骤耗时；各步骤统一在 RGB 上进行（与识别时的输入一致）
+        image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # 所有分析共用一张转正后的灰度缩略图，坐标按 factor 换算回原图
+        start = time.perf_counter()
+        thumb, factor = _analysis_image(image)
+        if orientation in EXIF_TRANSPOSE:
+            thumb = thumb.transpose(EXIF_TRANSPOSE[orientation])
+        gray = np.asarray(thumb, dtype=np.int16)
+        analysis_seconds = time.perf_counter() - start
+
+        box, scale, angle, lut = None, 1.0, 0.0, None
+        oriented = (image.height, image.width) if orientation in (5, 6, 7, 8) else image.size
+        for step in self.steps:
+            start = time.perf_counter()
+            if step == "crop_border":
+                thumb_box = find_border(gray)
+                if thumb_box is not None:
+                    gray = gray[thumb_box[1]:thumb_box[3], thumb_box[0]:thumb_box[2]]
+                    box = tuple(min(value * factor, limit) for value, limit in zip(thumb_box, oriented * 2))
+                applied = box is not None
+            elif step == "downscale":
+                region = (box[2] - box[0], box[3] - box[1]) if box else oriented
+                scale = min(1.0, self.max_side / max(region))
+                applied = bool(scale < 1.0)
+            elif step == "orientation":
+                applied = orientation in EXIF_TRANSPOSE
+            elif step == "deskew":
+                angle = estimate_skew(gray)
+                if abs(angle) < DESKEW_MIN_ANGLE:
+                    angle = 0.0
+                applied = bool(angle)
+            else:
+                lut = contrast_lut(gray)
+                applied = lut is not None
+            report[step] = (applied, time.perf_counter() - start)
+
+        # 裁剪、缩放、转正、纠偏合成一次重采样，对比度查找表作用于缩小后的图像
+        start = time.perf_counter()
+        if box is not None or scale < 1.0 or orientation in EXIF_TRANSPOSE or angle:
+            image = render(image, box, scale, orientation, angle, fill=_percentiles(gray, 50)[0])
+        if lut is not None:
+            image = image.point(lut * len(image.getbands()))
+        report["resample"] = (True, analysis_seconds + time.perf_counter() - start)
+        with self._lock:
+            self._images += 1
+            self._pixels_in += pixels_in
+            self._pixels_out += image.width * image.height
+            for step, (applied, seconds) in report.items():
+                item = self._stats[step]
+                item["calls"] += 1
+                item["applied"] += int(applied)
+                item["seconds"] += seconds
+        return image, report
+
+    def __call__(self, image):
+        if not self.steps:
+            return image
+        return self.process(image)[0]
+
+    def stats(self):
+        """
+        各步骤的调用次数、生效次数与平均耗时（毫秒），以及像素总量的缩减比例
+        """
+        with self._lock:
+            return {
+                "images": self._images,
+                "pixel_ratio": self._pixels_out / self._pixels_in if self._pixels_in else 1.0,
+                "steps": {
+                    step: {
+                        "calls": item["calls"],
+                        "applied": item["applied"],
+                        "mean_ms": item["seconds"] * 1000 / item["calls"] if item["calls"] else 0.0,
+                    }
+                    for step, item in self._stats.items()
+                },
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推理前图像预处理（方向、裁边、缩放、纠偏、对比度），输出各步骤耗时")
+    parser.add_argument("inputs", nargs="+", help="待处理的图片")
+    parser.add_argument("--steps", default="all", help=f"逗号分隔的步骤，可选: {', '.join(PREPROCESS_STEPS)}")
+    parser.add_argument("--max-side", type=int, default=2400, help="缩放后的最大长边")
+    parser.add_argument("--output", default=None, help="处理结果的保存目录，不指定则只统计耗时")
+    args = parser.parse_args()
+
+    steps = PREPROCESS_STEPS if args.steps == "all" else [step.strip() for step in args.steps.split(",") if step.strip()]
+    preprocessor = ImagePreprocessor(steps, max_side=args.max_side)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    for path in args.inputs:
+        with Image.open(path) as source:
+            source.load()
+            size_in = source.size
+            image, report = preprocessor.process(source)
+        timings = "  ".join(f"{step}{'*' if applied else ''} {seconds * 1000:.1f}ms" for step, (applied, seconds) in report.items())
+        print(f"{path}: {size_in[0]}x{size_in[1]} -> {image.width}x{image.height}  {timings}")
+        if args.output:
+            image.save(os.path.join(args.output, os.path.basename(path)))
+    stats = preprocessor.stats()
+    print(f"共 {stats['images']} 张，像素量为原来的 {stats['pixel_ratio']:.0%}（* 表示该步骤生效）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+FAIRNESS_POLICIES = ("round_robin", "fifo")
+
+
+class _PendingRequest:
+    __slots__ = ("job_id", "image", "prompt", "params", "future", "enqueued_at")
+
+    def __init__(self, job_id, image, prompt, params):
+        self.job_id = job_id
+        self.image = image
+        self.prompt = prompt
+        self.params = params
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class InferenceScheduler:
+    """
+    跨任务的动态微批调度器
+    收集所有活动任务提交的版面检测/块识别请求，在时间窗口内凑批后交给副本池中的空闲副本推理，
+    再把结果分发回各任务；每个副本对应一个分发线程
+    """
+
+    def __init__(self, pool, max_batch_size=8, max_wait_ms=20, fairness="round_robin"):
+        if fairness not in FAIRNESS_POLICIES:
+            raise ValueError(f"未知的公平策略: {fairness}，可选: {', '.join(FAIRNESS_POLICIES)}")
+        self.pool = pool
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self.fairness = fairness
+
+        self._queues = OrderedDict()  # 任务ID -> 待处理请求队列
+        self._cond = threading.Condition()
+        self._closed = False
+        self.batches = 0
+        self.requests = 0
+
+        self._threads = [
+            threading.Thread(target=self._run, name=f"inference-scheduler-{i}", daemon=True)
+            for i in range(pool.size)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @classmethod
+    def from_env(cls, pool, max_batch_size=None):
+        """
+        从环境变量读取批大小、最长等待时间和公平策略；max_batch_size（如自动调优的结果）优先于环境变量
+        """
+        return cls(
+            pool,
+            max_batch_size=max_batch_size or int(os.environ.get("OCR_BATCH_SIZE", 8)),
+            max_wait_ms=float(os.environ.get("OCR_BATCH_WAIT_MS", 20)),
+            fairness=os.environ.get("OCR_BATCH_FAIRNESS", "round_robin"),
+        )
+
+    def submit(self, job_id, images, prompts, params):
+        """
+        提交一组请求，返回与之一一对应的 Future 列表
+        """
+        requests = [_PendingRequest(job_id, *args) for args in zip(images, prompts, params)]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("推理调度器已关闭")
+            self._queues.setdefault(job_id, deque()).extend(requests)
+            self._cond.notify()
+        return [request.future for request in requests]
+
+    def client_for_job(self, job_id):
+        """
+        返回一个 MinerUClient 视图，其底层推理请求经由本调度器凑批
+        """
+        job_client = copy.copy(self.pool.template)
+        job_client.client = _JobVlmClient(self, job_id)
+        return job_client
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _pending_count(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _oldest_enqueued_at(self):
+        return min(queue[0].enqueued_at for queue in self._queues.values() if queue)
+
+    def _take_batch(self):
+        batch = []
+        if self.fairness == "fifo":
+            while len(batch) < self.max_batch_size and self._pending_count():
+                job_id = min(
+                    (job_id for job_id, queue in self._queues.items() if queue),
+                    key=lambda job_id: self._queues[job_id][0].enqueued_at,
+                )
+                batch.append(self._queues[job_id].popleft())
+        else:
+            # 轮询各任务，每轮每个任务取一个请求；被取过的任务移到队尾，下一批从其他任务开始
+            while len(batch) < self.max_batch_size and self._pending_count():
+                for job_id in list(self._queues):
+                    queue = self._queues[job_id]
+                    if queue and len(batch) < self.max_batch_size:
+                        batch.append(queue.popleft())
+                        self._queues.move_to_end(job_id)
+        for job_id in [job_id for job_id, queue in self._queues.items() if not queue]:
+            del self._queues[job_id]
+        return batch
+
+    def _collect_batch(self):
+        with self._cond:
+            while not self._closed and not self._pending_count():
+                self._cond.wait()
+            # 凑满一批或最早的请求等待超时即发出
+            while not self._closed and self._pending_count() < self.max_batch_size:
+                remaining = self._oldest_enqueued_at() + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._take_batch()
+
+    def _run(self):
+        while True:
+            # 先凑批再借出副本：空闲等待期间不占用副本，副本池的健康检查才能轮到它们
+            batch = self._collect_batch()
+            if not batch:
+                if self._closed:
+                    return
+                continue
+            try:
+                with self.pool.checkout() as replica:
+                    # 同一采样参数的请求排在一起，transformers 后端按参数分组推理
+                    batch.sort(key=lambda request: repr(request.params))
+                    vlm_client = replica.client
+                    # transformers 后端内部按 batch_size 切分，需不小于调度批大小才能真正合批
+                    if getattr(vlm_client, "batch_size", None) is not None:
+                        vlm_client.batch_size = max(vlm_client.batch_size, self.max_batch_size)
+                    outputs = vlm_client.batch_predict(
+                        [request.image for request in batch],
+                        [request.prompt for request in batch],
+                        [request.params for request in batch],
+                    )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            for request, output in zip(batch, outputs):
+                request.future.set_result(output)
+
+
+class _JobVlmClient:
+    """
+    单个任务使用的推理客户端代理，把 predict/batch_predict 转交给调度器
+    """
+
+    def __init__(self, scheduler, job_id):
+        self.scheduler = scheduler
+        self.job_id = job_id
+
+    def __getattr__(self, name):
+        return getattr(self.scheduler.pool.template.client, name)
+
+    def predict(self, image, prompt="", sampling_params=None, priority=None, **kwargs):
+        return self.batch_predict([image], [prompt], [sampling_params])[0]
+
+    def batch_predict(self, images, prompts="", sampling_params=None, priority=None, **kwargs):
+        if isinstance(prompts, str):
+            prompts = [prompts] * len(images)
+        if not isinstance(sampling_params, (list, tuple)):
+            sampling_params = [sampling_params] * len(images)
+        futures = self.scheduler.submit(self.job_id, images, prompts, sampling_params)
+        return [future.result() for future in futures]
@@ -0,0 +1,252 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import os
+import threading
+import time
+from collections import deque
+from PIL import Image
+
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    PDF_SUPPORT = True
+except ImportError:
+    PDF_SUPPORT = False
+
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_SUPPORT = True
+except ImportError:
+    PDFIUM_SUPPORT = False
+
+SCHEDULING_POLICIES = ("wfq", "sjf")
+
+# 按页数划分的任务规模档位: (名称, 页数上限)
+SIZE_CLASSES = (("small", 5), ("medium", 50), ("large", None))
+
+# 以 A4 纸 200dpi 渲染的像素数作为一页的基准开销
+REFERENCE_PAGE_PIXELS = 1654 * 2339
+
+
+def pdf_page_count(pdf_path):
+    """
+    读取PDF的准确页数（不渲染页面），决定哪些页面会被识别；文件无法解析时抛出 ValueError
+    """
+    if PDFIUM_SUPPORT:
+        try:
+            document = pdfium.PdfDocument(pdf_path)
+        except pdfium.PdfiumError as e:
+            raise ValueError(f"无法读取PDF文件: {pdf_path}: {e}") from e
+        try:
+            return len(document)
+        finally:
+            document.close()
+    if PDF_SUPPORT:
+        try:
+            return int(pdfinfo_from_path(pdf_path)["Pages"])
+        except Exception as e:
+            raise ValueError(f"无法读取PDF文件: {pdf_path}: {e}") from e
+    raise ImportError("pypdfium2 和 pdf2image 均未安装，无法读取PDF页数")
+
+
+def document_page_count(file_path):
+    """
+    文档页数: PDF 为准确页数，图片为1
+    """
+    if os.path.splitext(file_path)[1].lower() == ".pdf":
+        return pdf_page_count(file_path)
+    return 1
+
+
+def estimate_page_cost(file_path):
+    """
+    按渲染尺寸预估单页开销（仅用于调度，不影响识别哪些页面）
+    """
+    if os.path.splitext(file_path)[1].lower() == ".pdf":
+        return 1.0
+    # 图片只读文件头获取尺寸
+    with Image.open(file_path) as image:
+        width, height = image.size
+    return max(0.25, width * height / REFERENCE_PAGE_PIXELS)
+
+
+def render_pdf_page(pdf_path, page_num, dpi=200):
+    """
+    单独渲染PDF的某一页（页码从1开始）
+    """
+    if not PDF_SUPPORT:
+        raise ImportError("pdf2image未安装，无法处理PDF文件")
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num)
+    if not images:
+        raise ValueError(f"PDF文件没有第 {page_num} 页: {pdf_path}")
+    return images[0]
+
+
+def size_class(page_count):
+    for name, limit in SIZE_CLASSES:
+        if limit is None or page_count <= limit:
+            return name
+
+
+class PageJob:
+    """
+    按页调度的OCR任务，run_page(页索引) 返回该页的识别块
+    """
+
+    def __init__(self, page_count, run_page, page_cost=1.0, weight=1.0):
+        self.page_count = page_count
+        self.run_page = run_page
+        self.page_cost = page_cost
+        self.weight = weight
+        self.size_class = size_class(page_count)
+
+        self.results = [None] * page_count
+        self.completed = []  # 按完成顺序记录的页索引
+        self.error = None
+        self.done = threading.Event()
+
+        self.next_page = 0
+        self.running = 0
+        self.virtual_time = 0.0
+        self.submitted_at = None
+        self.first_dispatched_at = None
+        self.last_dispatched_at = None
+        self.finished_at = None
+
+    @property
+    def remaining_cost(self):
+        return (self.page_count - self.next_page) * self.page_cost
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+class PageScheduler:
+    """
+    页粒度的任务调度器
+    wfq: 加权公平排队，各任务按 单页开销/权重 推进虚拟时间，小任务与大任务交替执行
+    sjf: 最短剩余任务优先，长时间未被调度的任务优先补发一页以免饿死
+    """
+
+    def __init__(self, n_workers=4, policy="wfq", starvation_seconds=30, history_size=200):
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}，可选: {', '.join(SCHEDULING_POLICIES)}")
+        self.policy = policy
+        self.starvation_seconds = starvation_seconds
+        self._jobs = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._history = {name: deque(maxlen=history_size) for name, _ in SIZE_CLASSES}
+
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"page-worker-{i}", daemon=True)
+            for i in range(max(1, n_workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @classmethod
+    def from_env(cls, default_workers=4):
+        return cls(
+            n_workers=int(os.environ.get("OCR_PAGE_WORKERS", default_workers)),
+            policy=os.environ.get("OCR_SCHEDULING_POLICY", "wfq"),
+        )
+
+    def submit(self, job):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("页调度器已关闭")
+            job.submitted_at = time.monotonic()
+            # 新任务从当前最小虚拟时间起步，避免凭空获得大量积压份额
+            job.virtual_time = min((j.virtual_time for j in self._jobs), default=0.0)
+            self._jobs.append(job)
+            self._cond.notify_all()
+        return job
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _select_job(self):
+        candidates = [job for job in self._jobs if job.next_page < job.page_count and job.error is None]
+        if not candidates:
+            return None
+        if self.policy == "wfq":
+            return min(candidates, key=lambda job: (job.virtual_time, job.submitted_at))
+        now = time.monotonic()
+        starving = [
+            job for job in candidates
+            if now - (job.last_dispatched_at or job.submitted_at) > self.starvation_seconds
+        ]
+        if starving:
+            return min(starving, key=lambda job: job.last_dispatched_at or job.submitted_at)
+        return min(candidates, key=lambda job: (job.remaining_cost, job.submitted_at))
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._select_job()
+                while job is None and not self._closed:
+                    self._cond.wait()
+                    job = self._select_job()
+                if job is None:
+                    return
+                page_index = job.next_page
+                job.next_page += 1
+                job.running += 1
+                job.virtual_time += job.page_cost / job.weight
+                job.last_dispatched_at = time.monotonic()
+                if job.first_dispatched_at is None:
+                    job.first_dispatched_at = job.last_dispatched_at
+
+            try:
+                result = job.run_page(page_index)
+                error = None
+            except Exception as e:
+                result, error = None, e
+
+            with self._cond:
+                job.running -= 1
+                if error is not None:
+                    # 任一页失败即终止整个任务，不再派发剩余页面
+                    job.error = job.error or error
+                else:
+                    job.results[page_index] = result
+                    job.completed.append(page_index)
+                finished = job.running == 0 and (job.error is not None or len(job.completed) == job.page_count)
+                if finished and not job.done.is_set():
+                    self._finish(job)
+
+    def _finish(self, job):
+        job.finished_at = time.monotonic()
+        self._jobs.remove(job)
+        if job.error is None:
+            self._history[job.size_class].append((
+                job.first_dispatched_at - job.submitted_at,
+                job.finished_at - job.submitted_at,
+            ))
+        job.done.set()
+        self._cond.notify_all()
+
+    def stats(self):
+        """
+        按任务规模档位统计排队等待和总耗时（秒）
+        """
+        classes = {}
+        with self._cond:
+            for name, history in self._history.items():
+                if not history:
+                    continue
+                waits = [wait for wait, _ in history]
+                latencies = sorted(latency for _, latency in history)
+                classes[name] = {
+                    "jobs": len(history),
+                    "mean_wait": sum(waits) / len(waits),
+                    "p50_latency": latencies[len(latencies) // 2],
+                    "p95_latency": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                }
+            return {"policy": self.policy, "active_jobs": len(self._jobs), "classes": classes}
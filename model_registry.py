@@ -0,0 +1,194 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import gc
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 参与估算模型体积的权重文件后缀
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth")
+
+
+def model_revision(model_path):
+    """
+    由模型目录内文件的名称、大小和修改时间生成修订号，同一路径下替换了权重会得到新的修订号
+    """
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(model_path)):
+        file_path = os.path.join(model_path, name)
+        if os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            digest.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+    return digest.hexdigest()[:12]
+
+
+def estimate_model_bytes(model_path):
+    """
+    按权重文件体积估算单个副本常驻内存
+    """
+    return sum(
+        os.path.getsize(os.path.join(model_path, name))
+        for name in os.listdir(model_path)
+        if name.endswith(WEIGHT_SUFFIXES)
+    )
+
+
+class ModelNotResident(KeyError):
+    """
+    要租用的模型未加载或已被淘汰
+    """
+
+
+class ModelEntry:
+    """
+    已加载的模型: 副本池 + 推理调度器，由 lease 计数保护，退役后在最后一个任务结束时释放
+    """
+
+    def __init__(self, key, model_path, revision, variant, pool, scheduler, memory_bytes):
+        self.key = key
+        self.model_path = model_path
+        self.revision = revision
+        self.variant = variant
+        self.pool = pool
+        self.scheduler = scheduler
+        self.memory_bytes = memory_bytes
+        self.leases = 0
+        self.retired = False
+        self.last_used = time.monotonic()
+
+    @property
+    def label(self):
+        # 远程端点直接显示地址，本地模型显示目录名
+        name = self.model_path if "://" in self.model_path else os.path.basename(os.path.normpath(self.model_path))
+        label = f"{name}@{self.revision}"
+        return f"{label} ({self.variant})" if self.variant else label
+
+    def release(self):
+        self.scheduler.close()
+        self.pool.close()
+        self.scheduler = None
+        self.pool = None
+
+
+class ModelRegistry:
+    """
+    多模型注册表，以 路径@修订号[+加载方式] 为键
+    常驻模型数和内存预算超限时淘汰最久未使用的模型；切换默认模型是原子的，
+    进行中的任务持有 lease，始终在开始时的模型上跑完
+    """
+
+    def __init__(self, loader, max_models=2, memory_budget_bytes=None):
+        self.loader = loader  # loader(model_path, replicas=, variant=, **kwargs) -> (副本池, 推理调度器)
+        self.max_models = max(1, int(max_models))
+        self.memory_budget_bytes = memory_budget_bytes
+        self._entries = {}  # 键 -> ModelEntry，仅包含常驻模型
+        self._default_key = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, loader):
+        memory_gb = os.environ.get("OCR_MODEL_MEMORY_GB")
+        return cls(
+            loader,
+            max_models=int(os.environ.get("OCR_MAX_MODELS", 2)),
+            memory_budget_bytes=float(memory_gb) * 1024 ** 3 if memory_gb else None,
+        )
+
+    def choices(self):
+        """
+        常驻模型列表: [(显示名, 键)]，按最近使用排序
+        """
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry.last_used, reverse=True)
+            return [(entry.label, entry.key) for entry in entries]
+
+    @property
+    def default_key(self):
+        return self._default_key
+
+    def load(self, model_path, revision=None, variant=None, replicas=1, set_default=True, **load_kwargs):
+        """
+        加载模型（已常驻则直接复用），必要时先淘汰旧模型腾出空间；返回模型键
+        variant 区分同一权重的不同加载方式（如CPU推理配置）
+        远程推理端点（http(s) 地址）不占用本地内存，修订号默认为 remote
+        """
+        local = "://" not in model_path
+        if local:
+            model_path = os.path.abspath(model_path)
+        revision = revision or (model_revision(model_path) if local else "remote")
+        key = f"{model_path}@{revision}" + (f"+{variant}" if variant else "")
+
+        with self._load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                memory_bytes = estimate_model_bytes(model_path) * replicas if local else 0
+                self._make_room(memory_bytes)
+                pool, scheduler = self.loader(model_path, replicas=replicas, variant=variant, **load_kwargs)
+                entry = ModelEntry(key, model_path, revision, variant, pool, scheduler, memory_bytes)
+                with self._lock:
+                    self._entries[key] = entry
+
+        with self._lock:
+            entry.last_used = time.monotonic()
+            if set_default:
+                self._default_key = key
+        return key
+
+    def _make_room(self, incoming_bytes):
+        """
+        按 LRU 淘汰模型，直到能容纳即将加载的模型
+        """
+        while True:
+            with self._lock:
+                resident_bytes = sum(entry.memory_bytes for entry in self._entries.values())
+                over_count = len(self._entries) + 1 > self.max_models
+                over_memory = (
+                    self.memory_budget_bytes is not None
+                    and resident_bytes + incoming_bytes > self.memory_budget_bytes
+                )
+                if not self._entries or not (over_count or over_memory):
+                    return
+                victim = min(self._entries.values(), key=lambda entry: entry.last_used)
+                del self._entries[victim.key]
+                if self._default_key == victim.key:
+                    self._default_key = None
+                victim.retired = True
+                release_now = victim.leases == 0
+            if release_now:
+                self._release(victim)
+
+    @contextmanager
+    def lease(self, key=None):
+        """
+        租用指定模型（缺省为当前默认模型），租用期间该模型不会被释放；模型不在内存中时抛出 ModelNotResident
+        """
+        with self._lock:
+            entry = self._entries.get(key or self._default_key)
+            if entry is None:
+                raise ModelNotResident(key or "default")
+            entry.leases += 1
+            entry.last_used = time.monotonic()
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                release_now = entry.retired and entry.leases == 0
+            if release_now:
+                self._release(entry)
+
+    def _release(self, entry):
+        entry.release()
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
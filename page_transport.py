@@ -0,0 +1,304 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import ctypes
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import traceback
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from PIL import Image
+
+from job_scheduler import pdf_page_count, render_pdf_page
+
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_SUPPORT = True
+except ImportError:
+    PDFIUM_SUPPORT = False
+
+# A4 纸 200dpi 渲染为 RGBX 所需字节数，向上取整到 MiB；超出的页面使用一次性的共享内存段
+DEFAULT_SLOT_BYTES = math.ceil(1654 * 2339 * 4 / (1 << 20)) * (1 << 20)
+
+# Image.frombuffer 能直接引用外部内存（不复制）的模式
+ZERO_COPY_MODES = ("L", "RGBX", "RGBA")
+
+
+def _attach(name):
+    # Python 3.13 起可关闭附加方的资源跟踪，段的生命周期只由创建方管理
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    return SharedMemory(name=name)
+
+
+class PageHandle:
+    """
+    跨进程传递的页面句柄，只包含共享内存段名称、尺寸和像素模式
+    """
+    __slots__ = ("name", "size", "mode", "page_index", "pooled")
+
+    def __init__(self, name, size, mode, page_index=0, pooled=True):
+        self.name = name
+        self.size = size
+        self.mode = mode
+        self.page_index = page_index
+        self.pooled = pooled
+
+    def __getstate__(self):
+        return (self.name, self.size, self.mode, self.page_index, self.pooled)
+
+    def __setstate__(self, state):
+        self.name, self.size, self.mode, self.page_index, self.pooled = state
+
+
+class SharedPagePool:
+    """
+    共享内存页面缓冲池（由渲染进程创建和持有）
+    页面直接渲染进空闲槽位，工作进程用完后把槽位名称放回 release_queue 循环使用
+    """
+
+    def __init__(self, slots=4, slot_bytes=DEFAULT_SLOT_BYTES, context=None):
+        context = context or multiprocessing.get_context("spawn")
+        self.slot_bytes = slot_bytes
+        self.release_queue = context.Queue()  # 任意进程用完页面后放回槽位名称
+        self._segments = {}
+        self._oneoff = {}  # 超出槽位大小的页面单独分配，归还时释放
+        for _ in range(max(1, int(slots))):
+            segment = SharedMemory(create=True, size=slot_bytes)
+            self._segments[segment.name] = segment
+            self.release_queue.put(segment.name)
+
+    def _acquire(self, nbytes, timeout=None):
+        if nbytes > self.slot_bytes:
+            segment = SharedMemory(create=True, size=nbytes)
+            self._oneoff[segment.name] = segment
+            return segment, False
+        while True:
+            try:
+                name = self.release_queue.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError("等待空闲页面缓冲超时")
+            if name in self._oneoff:
+                segment = self._oneoff.pop(name)
+                segment.close()
+                segment.unlink()
+                continue
+            return self._segments[name], True
+
+    def render_pdf_page(self, pdf_document, page_index, dpi=200, timeout=None):
+        """
+        用 pdfium 把PDF页面直接渲染进共享内存（RGBX），不经过中间图像
+        """
+        acquired = {}
+
+        def bitmap_maker(width, height, format, rev_byteorder):
+            nbytes = width * height * 4
+            segment, pooled = self._acquire(nbytes, timeout)
+            acquired.update(segment=segment, pooled=pooled, size=(width, height))
+            acquired["buffer"] = (ctypes.c_ubyte * nbytes).from_buffer(segment.buf)
+            return pdfium.PdfBitmap.new_native(width, height, format, rev_byteorder, buffer=acquired["buffer"])
+
+        page = pdf_document[page_index]
+        try:
+            # rev_byteorder + prefer_bgrx 得到 RGBx 字节序，可被 PIL 以 RGBX 模式直接引用
+            bitmap = page.render(scale=dpi / 72, rev_byteorder=True, prefer_bgrx=True, bitmap_maker=bitmap_maker)
+            bitmap.close()
+        finally:
+            page.close()
+            # 释放 ctypes 对共享内存的引用，否则该段无法关闭
+            acquired.pop("buffer", None)
+        return PageHandle(acquired["segment"].name, acquired["size"], "RGBX", page_index, acquired["pooled"])
+
+    def put_image(self, image, page_index=0, timeout=None):
+        """
+        把已有的 PIL 图像写入共享内存（复制一次），用于图片文件或没有 pdfium 的环境
+        """
+        if image.mode not in ZERO_COPY_MODES:
+            image = image.convert("RGBX" if image.mode != "RGBA" else "RGBA")
+        data = image.tobytes()
+        segment, pooled = self._acquire(len(data), timeout)
+        segment.buf[:len(data)] = data
+        return PageHandle(segment.name, image.size, image.mode, page_index, pooled)
+
+    def close(self):
+        for segment in list(self._segments.values()) + list(self._oneoff.values()):
+            segment.close()
+            segment.unlink()
+        self._segments.clear()
+        self._oneoff.clear()
+
+
+class PageReader:
+    """
+    工作进程侧: 按句柄附加共享内存并零拷贝构建 PIL 图像，附加的槽位在进程内缓存复用
+    """
+
+    def __init__(self, release_queue):
+        self.release_queue = release_queue
+        self._attached = {}
+
+    @contextmanager
+    def open(self, handle):
+        """
+        得到的图像直接引用共享内存，只在 with 块内有效，退出后槽位即被回收
+        """
+        segment = self._attached.get(handle.name)
+        if segment is None:
+            segment = _attach(handle.name)
+            if handle.pooled:
+                self._attached[handle.name] = segment
+        image = Image.frombuffer(handle.mode, handle.size, segment.buf, "raw", handle.mode, 0, 1)
+        try:
+            yield image
+        finally:
+            image.close()
+            del image
+            if not handle.pooled:
+                segment.close()
+            self.release_queue.put(handle.name)
+
+    def close(self):
+        for segment in self._attached.values():
+            try:
+                segment.close()
+            except BufferError:
+                # 调用方仍持有引用共享内存的图像，交由进程退出时释放
+                pass
+        self._attached.clear()
+
+
+def _worker_main(worker_init, init_args, worker_fn, task_queue, result_queue, release_queue):
+    state = worker_init(*init_args) if worker_init is not None else None
+    reader = PageReader(release_queue)
+    while True:
+        handle = task_queue.get()
+        if handle is None:
+            break
+        try:
+            with reader.open(handle) as image:
+                result = worker_fn(state, image)
+            result_queue.put((handle.page_index, result, None))
+        except Exception:
+            result_queue.put((handle.page_index, None, traceback.format_exc()))
+    reader.close()
+
+
+class SharedMemoryPagePipeline:
+    """
+    多进程页面流水线: 当前进程把页面渲染进共享内存，工作进程各自初始化一次（如加载模型）后按句柄处理
+    进程间只传递句柄，页面像素不经过 pickle；槽位数限制了渲染可以领先处理的页数
+    worker_init(*init_args) 的返回值作为 worker_fn(state, image) 的第一个参数，二者需为模块级函数
+    """
+
+    def __init__(self, worker_fn, worker_init=None, init_args=(), workers=2, slots=None,
+                 slot_bytes=DEFAULT_SLOT_BYTES, dpi=200):
+        self.dpi = dpi
+        context = multiprocessing.get_context("spawn")
+        self.pool = SharedPagePool(slots or workers * 2, slot_bytes, context)
+        self._task_queue = context.Queue()
+        self._result_queue = context.Queue()
+        self._processes = [
+            context.Process(
+                target=_worker_main,
+                args=(worker_init, init_args, worker_fn, self._task_queue, self._result_queue, self.pool.release_queue),
+                name=f"page-worker-{i}",
+                daemon=True,
+            )
+            for i in range(max(1, int(workers)))
+        ]
+        for process in self._processes:
+            process.start()
+
+    def _submit_pages(self, file_path):
+        if os.path.splitext(file_path)[1].lower() != ".pdf":
+            with Image.open(file_path) as image:
+                self._task_queue.put(self.pool.put_image(image, 0))
+            return 1
+        if PDFIUM_SUPPORT:
+            document = pdfium.PdfDocument(file_path)
+            try:
+                for page_index in range(len(document)):
+                    self._task_queue.put(self.pool.render_pdf_page(document, page_index, self.dpi))
+                return len(document)
+            finally:
+                document.close()
+        page_count = pdf_page_count(file_path)
+        for page_index in range(page_count):
+            self._task_queue.put(self.pool.put_image(render_pdf_page(file_path, page_index + 1, self.dpi), page_index))
+        return page_count
+
+    def run(self, file_path):
+        """
+        处理一个PDF或图片，按页序返回各页结果；任一页失败时抛出 RuntimeError
+        """
+        page_count = self._submit_pages(file_path)
+        results = [None] * page_count
+        errors = []
+        for _ in range(page_count):
+            page_index, result, error = self._result_queue.get()
+            results[page_index] = result
+            if error is not None:
+                errors.append(f"第 {page_index + 1} 页处理失败:\n{error}")
+        if errors:
+            raise RuntimeError("\n".join(errors))
+        return results
+
+    def close(self):
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for process in self._processes:
+            process.join()
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def ocr_worker_init(model_path, cpu_profile=None, torch_threads=None):
+    """
+    工作进程初始化: 限制 torch 线程数并加载一次模型
+    """
+    from distributed_ocr import load_client
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    return load_client(model_path, cpu_profile)
+
+
+def ocr_page(client, image):
+    from basic_demo import process_single_image
+    return process_single_image(image, client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程OCR: 页面经共享内存传递给各工作进程")
+    parser.add_argument("--model", required=True, help="模型文件夹路径或远程推理端点地址")
+    parser.add_argument("--input", required=True, help="待识别的PDF或图片")
+    parser.add_argument("--workers", type=int, default=2, help="工作进程数，每个进程各加载一份模型")
+    parser.add_argument("--cpu-profile", default=None, help="CPU推理配置（见 cpu_profile.py）")
+    parser.add_argument("--dpi", type=int, default=200)
+    args = parser.parse_args()
+
+    from basic_demo import save_ocr_results_as_formatted_md
+    # 各工作进程均分CPU核，避免线程超额订阅
+    torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    with SharedMemoryPagePipeline(
+        ocr_page, ocr_worker_init, (args.model, args.cpu_profile, torch_threads), workers=args.workers, dpi=args.dpi
+    ) as pipeline:
+        pages = pipeline.run(args.input)
+    if os.path.splitext(args.input)[1].lower() == ".pdf":
+        save_ocr_results_as_formatted_md(pages, args.input, multipage=True)
+    else:
+        save_ocr_results_as_formatted_md(pages[0], args.input, multipage=False)
+
+
+if __name__ == "__main__":
+    main()
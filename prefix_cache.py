@@ -0,0 +1,294 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import copy
+import inspect
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import torch
+from PIL import Image
+from mineru_vl_utils.vlm_client.transformers_client import TransformersVlmClient
+
+# 前缀KV缓存的默认内存上限（MiB），缓存张量与模型位于同一设备
+DEFAULT_PREFIX_CACHE_MB = 256
+
+
+def _cache_tensors(cache):
+    # 兼容按层存放（layers）与按键值列表存放（key_cache/value_cache）两种 DynamicCache 结构
+    if hasattr(cache, "layers"):
+        for layer in cache.layers:
+            yield layer.keys
+            yield layer.values
+    else:
+        yield from cache.key_cache
+        yield from cache.value_cache
+
+
+def cache_nbytes(cache):
+    return sum(tensor.numel() * tensor.element_size() for tensor in _cache_tensors(cache) if tensor is not None)
+
+
+class PrefixKVCache:
+    """
+    提示词前缀的KV缓存，按（模型, 前缀token序列）索引，总字节数超出上限时淘汰最久未用的条目
+    同时汇总使用/未使用缓存时每个请求（即每个识别块）的平均耗时，便于对比
+    """
+
+    def __init__(self, max_bytes=DEFAULT_PREFIX_CACHE_MB << 20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefix_tokens = 0
+        self._timings = {"cached": [0, 0.0], "uncached": [0, 0.0]}
+
+    @classmethod
+    def from_env(cls):
+        """
+        OCR_PREFIX_CACHE_MB: 缓存上限（MiB），0 表示不启用
+        """
+        return cls(int(float(os.environ.get("OCR_PREFIX_CACHE_MB", DEFAULT_PREFIX_CACHE_MB)) * (1 << 20)))
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, cache):
+        size = cache_nbytes(cache)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (cache, size)
+            self._bytes += size
+            self.prefix_tokens = len(key[1])
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def record(self, mode, requests, seconds):
+        """
+        记录一批请求的耗时，mode 为 "cached" 或 "uncached"
+        """
+        with self._lock:
+            timing = self._timings[mode]
+            timing[0] += requests
+            timing[1] += seconds
+
+    def reset_timings(self):
+        with self._lock:
+            self._timings = {"cached": [0, 0.0], "uncached": [0, 0.0]}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "prefix_tokens": self.prefix_tokens,
+                **{
+                    mode: {
+                        "requests": requests,
+                        "ms_per_request": seconds * 1000 / requests if requests else 0.0,
+                    }
+                    for mode, (requests, seconds) in self._timings.items()
+                },
+            }
+
+
+class PrefixCachingVlmClient(TransformersVlmClient):
+    """
+    复用提示词公共前缀KV状态的 transformers 推理客户端
+    同一模型的所有请求共享图像之前的 token（系统提示词和对话模板开头，几十个 token），这部分的KV只计算一次；
+    每个请求从缓存的前缀续算图像和提示词，再交给 generate 解码
+    图像之后的任务指令在因果注意力下依赖图像内容，无法跨请求复用，仍逐请求预填充
+    只处理没有填充的批次（默认 batch_size 下每批一个请求），其余情况走原始实现；
+    当前 transformers 版本接口不兼容时自动停用
+    """
+
+    @classmethod
+    def wrap(cls, vlm_client, prefix_cache):
+        """
+        基于已有的 TransformersVlmClient 创建（共享模型和处理器）
+        """
+        client = cls.__new__(cls)
+        client.__dict__.update(vlm_client.__dict__)
+        client.prefix_cache = prefix_cache
+        client.enabled = True
+        # 每个模型实例单独一组缓存条目，卸载后由 LRU 淘汰
+        client.model_key = uuid.uuid4().hex
+        client.image_token_id = client.model.config.image_token_id
+        forward_parameters = inspect.signature(client.model.forward).parameters
+        if "logits_to_keep" in forward_parameters:
+            client._logits_kwargs = {"logits_to_keep": 1}
+        elif "num_logits_to_keep" in forward_parameters:
+            client._logits_kwargs = {"num_logits_to_keep": 1}
+        else:
+            client._logits_kwargs = {}
+        return client
+
+    def _predict_one_batch(self, image_objs, chat_prompts, sampling_params, **kwargs):
+        start = time.perf_counter()
+        outputs = None
+        if self.enabled and self.prefix_cache.enabled and not kwargs:
+            try:
+                outputs = self._predict_with_prefix(image_objs, chat_prompts, sampling_params)
+            except (AttributeError, TypeError, KeyError, NotImplementedError) as e:
+                self.enabled = False
+                print(f"前缀KV缓存与当前 transformers 版本不兼容，已停用: {e!r}")
+        mode = "cached" if outputs is not None else "uncached"
+        if outputs is None:
+            outputs = super()._predict_one_batch(image_objs, chat_prompts, sampling_params, **kwargs)
+        self.prefix_cache.record(mode, len(chat_prompts), time.perf_counter() - start)
+        return outputs
+
+    def _rope_owner(self):
+        # Qwen2-VL 的 get_rope_index/rope_deltas 在不同版本中位于外层模型或内层 model 上
+        for module in (self.model, getattr(self.model, "model", None)):
+            if module is not None and hasattr(module, "get_rope_index") and hasattr(module, "rope_deltas"):
+                return module
+        raise AttributeError("模型没有 get_rope_index/rope_deltas")
+
+    def _predict_with_prefix(self, image_objs, chat_prompts, sampling_params):
+        if not image_objs or any(image is None for image in image_objs):
+            return None
+        # 有填充时各行前缀所在位置不同，无法共用同一份KV；在处理图像之前判断，避免回退时重复预处理
+        # 图像 token 数只取决于图像尺寸，尺寸相同且文本 token 数相同的批次不会填充
+        if len(image_objs) > 1:
+            text_lengths = {len(ids) for ids in self.processor.tokenizer(list(chat_prompts))["input_ids"]}
+            if len(text_lengths) > 1 or len({image.size for image in image_objs}) > 1:
+                return None
+        inputs = self.processor(text=chat_prompts, images=image_objs, padding=True, return_tensors="pt")
+        inputs = inputs.to(device=self.model.device, dtype=self.model.dtype)
+        input_ids = inputs.input_ids
+        attention_mask = inputs.attention_mask
+        if not bool(attention_mask.all()):
+            return None
+        image_positions = (input_ids[0] == self.image_token_id).nonzero()
+        prefix_len = int(image_positions[0]) if len(image_positions) else 0
+        end = input_ids.shape[1] - 1
+        if prefix_len == 0 or prefix_len >= end or not bool((input_ids[:, :prefix_len] == input_ids[:1, :prefix_len]).all()):
+            return None
+
+        key = (self.model_key, tuple(input_ids[0, :prefix_len].tolist()))
+        rope_owner = self._rope_owner()
+        with torch.no_grad():
+            prefix_kv = self.prefix_cache.get(key)
+            if prefix_kv is None:
+                # 前缀只含文本 token，M-RoPE 的三个维度都是顺序位置，与后面的图像无关，可跨请求复用
+                prefix_kv = self.model(input_ids=input_ids[:1, :prefix_len], use_cache=True).past_key_values
+                self.prefix_cache.put(key, prefix_kv)
+            past_key_values = copy.deepcopy(prefix_kv)
+            if input_ids.shape[0] > 1:
+                past_key_values.batch_repeat_interleave(input_ids.shape[0])
+
+            # 在前缀之后续算图像和提示词（留最后一个 token 给 generate），位置编码按完整序列计算
+            position_ids, rope_deltas = rope_owner.get_rope_index(input_ids, inputs.image_grid_thw, None, attention_mask)
+            self.model(
+                input_ids=input_ids[:, prefix_len:end],
+                attention_mask=attention_mask[:, :end],
+                position_ids=position_ids[..., prefix_len:end],
+                pixel_values=inputs.pixel_values,
+                image_grid_thw=inputs.image_grid_thw,
+                past_key_values=past_key_values,
+                cache_position=torch.arange(prefix_len, end, device=input_ids.device),
+                use_cache=True,
+                **self._logits_kwargs,
+            )
+        # generate 只需处理最后一个 token，之后的解码位置由 rope_deltas 推算
+        rope_owner.rope_deltas = rope_deltas
+        output_ids = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+            **self.build_generate_kwargs(sampling_params),
+        )
+
+        output_ids = output_ids.cpu().tolist()
+        output_ids = [ids[len(in_ids):] for in_ids, ids in zip(input_ids, output_ids)]
+        output_ids = [[token_id for token_id in ids if token_id not in self.skip_token_ids] for ids in output_ids]
+        return self.processor.batch_decode(output_ids, skip_special_tokens=False, clean_up_tokenization_spaces=False)
+
+
+def enable_prefix_cache(mineru_client, prefix_cache):
+    """
+    为 transformers 后端的 MinerUClient 启用前缀KV缓存（原地替换其推理客户端），其他后端原样返回
+    """
+    if prefix_cache.enabled and isinstance(mineru_client.client, TransformersVlmClient):
+        mineru_client.client = PrefixCachingVlmClient.wrap(mineru_client.client, prefix_cache)
+    return mineru_client
+
+
+def benchmark(model_path, sample_image, cpu_profile=None, runs=1, max_bytes=DEFAULT_PREFIX_CACHE_MB << 20):
+    """
+    在样例页面上对比不用/使用前缀缓存时每个请求（版面检测和各识别块）的平均耗时，并检查输出是否一致
+    """
+    from mineru_vl_utils import MinerUClient
+    from basic_demo import initialize_model_and_processor
+
+    model, processor = initialize_model_and_processor(model_path, cpu_profile)
+    prefix_cache = PrefixKVCache(max_bytes)
+    client = enable_prefix_cache(MinerUClient(backend="transformers", model=model, processor=processor, use_tqdm=False), prefix_cache)
+    image = Image.open(sample_image)
+
+    # 预热一次，排除首次运行的初始化开销
+    client.client.enabled = False
+    client.two_step_extract(image)
+    prefix_cache.reset_timings()
+
+    outputs = {}
+    for enabled in (False, True):
+        client.client.enabled = enabled
+        outputs[enabled] = [client.two_step_extract(image) for _ in range(runs)]
+    stats = prefix_cache.stats()
+
+    def texts(results):
+        return [block.get("content") for blocks in results for block in blocks]
+
+    identical = texts(outputs[False]) == texts(outputs[True])
+    before, after = stats["uncached"]["ms_per_request"], stats["cached"]["ms_per_request"]
+    print(f"共享前缀 {stats['prefix_tokens']} 个 token，缓存 {stats['bytes'] / (1 << 20):.2f} MiB")
+    print(f"不用缓存: {stats['uncached']['requests']} 个请求，平均 {before:.1f} ms/请求")
+    print(f"使用缓存: {stats['cached']['requests']} 个请求，平均 {after:.1f} ms/请求")
+    if after:
+        print(f"加速比 {before / after:.3f}x，输出{'一致' if identical else '不一致'}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提示词前缀KV缓存: 对比使用前后每个识别块的推理耗时")
+    parser.add_argument("--model", required=True, help="模型文件夹的绝对路径")
+    parser.add_argument("--image", required=True, help="用于测试的样例页面图片")
+    parser.add_argument("--cpu-profile", default=None, help="CPU推理配置（见 cpu_profile.py）")
+    parser.add_argument("--runs", type=int, default=1, help="每种方式识别的次数")
+    parser.add_argument("--cache-mb", type=float, default=DEFAULT_PREFIX_CACHE_MB, help="缓存上限（MiB）")
+    args = parser.parse_args()
+    benchmark(args.model, args.image, args.cpu_profile, args.runs, int(args.cache_mb * (1 << 20)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import hashlib
+import re
+from io import BytesIO
+from PIL import Image
+
+# 可跨页复用识别结果的块类型（页码每页不同，始终重新识别）
+REUSABLE_BLOCK_TYPES = {"header", "footer"}
+
+# 页码计数形式的页脚（如 "12"、"Page 12 of 40"、"3/40"、"- iv -"、"第 5 页"）每页不同，不进入缓存；
+# "© 2024"、"Vol. 3" 等含数字的固定页脚仍可复用
+_PAGE_NUMBER = r"(?:\d+|(?=[ivxlcdm])m{0,3}(?:cm|cd|d?c{0,3})(?:xc|xl|l?x{0,3})(?:ix|iv|v?i{0,3}))"
+PAGE_COUNTER_PATTERN = re.compile(
+    rf"^\s*[-–—]?\s*(?:(?:page|p\.)\s*)?{_PAGE_NUMBER}(?:\s*(?:/|of)\s*\d+)?\s*[-–—]?\s*$"
+    r"|^\s*第\s*\d+\s*页(?:\s*[,，/]?\s*共\s*\d+\s*页)?\s*$",
+    re.IGNORECASE,
+)
+
+
+class RegionCache:
+    """
+    单个文档内的页眉/页脚区域识别缓存
+    仅以裁剪图的精确摘要为键：相差一个字符的页眉（如 "第3章"/"第4章"）像素不同，必须重新识别
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.exact = {}      # (块类型, 摘要) -> 文本，按插入顺序淘汰
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(block_image):
+        """
+        计算裁剪图的精确摘要（灰度像素 + 尺寸）
+        """
+        if isinstance(block_image, bytes):
+            block_image = Image.open(BytesIO(block_image))
+        gray = block_image.convert("L")
+        digest = hashlib.md5(gray.tobytes())
+        digest.update(f"{gray.width}x{gray.height}".encode())
+        return digest.hexdigest()
+
+    def lookup(self, block_type, fingerprint):
+        """
+        查找可复用的识别文本，未命中返回 None
+        """
+        content = self.exact.get((block_type, fingerprint))
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def store(self, block_type, fingerprint, content):
+        """
+        记录新识别的区域文本，含页码计数的页脚不缓存
+        """
+        if block_type == "footer" and PAGE_COUNTER_PATTERN.match(content or ""):
+            return
+        self.exact[(block_type, fingerprint)] = content
+        if len(self.exact) > self.max_entries:
+            self.exact.pop(next(iter(self.exact)))
+
+
+def cached_two_step_extract(client, image, region_cache):
+    """
+    带区域缓存的两步识别，流程与 MinerUClient.two_step_extract 一致，
+    仅页眉/页脚块在命中缓存时跳过第二步的内容识别
+    """
+    layout_result = client.layout_detect(image)
+    block_images, prompts, params, indices = client.helper.prepare_for_extract(image, layout_result)
+
+    pending = []
+    for block_image, prompt, param, idx in zip(block_images, prompts, params, indices):
+        block_type = layout_result[idx].type
+        fingerprint = None
+        if block_type in REUSABLE_BLOCK_TYPES:
+            fingerprint = region_cache.fingerprint(block_image)
+            content = region_cache.lookup(block_type, fingerprint)
+            if content is not None:
+                layout_result[idx].content = content
+                continue
+        pending.append((block_image, prompt, param, idx, fingerprint))
+
+    if pending:
+        outputs = client.client.batch_predict(
+            [item[0] for item in pending],
+            [item[1] for item in pending],
+            [item[2] for item in pending],
+        )
+        for (_, _, _, idx, fingerprint), output in zip(pending, outputs):
+            layout_result[idx].content = output
+            if fingerprint is not None:
+                region_cache.store(layout_result[idx].type, fingerprint, output)
+
+    return client.helper.post_process(layout_result)
@@ -0,0 +1,403 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from PIL import Image
+from mineru_vl_utils import MinerUClient, MinerUSamplingParams
+from mineru_vl_utils.vlm_client.base_client import RequestError, ServerError
+
+# 会触发重试和摘除的错误: 服务端错误和连接/超时等传输层错误
+RETRYABLE_ERRORS = (ServerError, httpx.HTTPError)
+
+
+def is_remote_spec(model_path):
+    """
+    模型路径是否为远程推理端点（逗号分隔的 http(s) 地址）
+    """
+    return isinstance(model_path, str) and model_path.strip().startswith(("http://", "https://"))
+
+
+def parse_endpoints(spec):
+    """
+    解析逗号分隔的端点地址列表
+    """
+    urls = [url.strip() for url in spec.split(",") if url.strip()] if isinstance(spec, str) else list(spec)
+    if not urls:
+        raise ValueError("未指定远程推理端点")
+    return urls
+
+
+class _Endpoint:
+    __slots__ = ("url", "client", "inflight", "requests", "failures", "consecutive_failures", "ejected_until")
+
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client  # HttpVlmClient，内部持有保活连接池
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = None
+
+
+class RemoteEndpointPool:
+    """
+    远程推理端点池，实现与 VlmClient 相同的 predict/batch_predict 接口
+    每个端点复用保活连接并允许多个在途请求；请求路由到在途数最少的健康端点，
+    失败后按指数退避换端点重试，连续失败的端点被摘除一段时间，冷却后放行一个试探请求
+    """
+
+    def __init__(self, server_urls, model_name=None, max_inflight_per_endpoint=4, max_retries=2,
+                 backoff_seconds=0.5, eject_after=3, eject_seconds=30, http_timeout=600):
+        self.max_inflight = max(1, int(max_inflight_per_endpoint))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_seconds = backoff_seconds
+        self.eject_after = max(1, int(eject_after))
+        self.eject_seconds = eject_seconds
+        self.http_timeout = http_timeout
+
+        urls = parse_endpoints(server_urls)
+        self.model_name = model_name or os.environ.get("MINERU_VL_MODEL_NAME") or self._discover_model_name(urls)
+        # 端点的 MinerUClient 仅用于构建 HttpVlmClient；重试由本池负责，关闭客户端自带的重试
+        self.mineru_clients = [self._new_mineru_client(url) for url in urls]
+        self._endpoints = [_Endpoint(url, client.client) for url, client in zip(urls, self.mineru_clients)]
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls, server_urls, model_name=None):
+        """
+        从环境变量读取每端点在途请求数、重试次数和摘除策略
+        """
+        return cls(
+            server_urls,
+            model_name=model_name,
+            max_inflight_per_endpoint=int(os.environ.get("OCR_REMOTE_INFLIGHT", 4)),
+            max_retries=int(os.environ.get("OCR_REMOTE_RETRIES", 2)),
+            backoff_seconds=float(os.environ.get("OCR_REMOTE_BACKOFF", 0.5)),
+            eject_after=int(os.environ.get("OCR_REMOTE_EJECT_AFTER", 3)),
+            eject_seconds=float(os.environ.get("OCR_REMOTE_EJECT_SECONDS", 30)),
+        )
+
+    def _new_mineru_client(self, url, model_name=None):
+        return MinerUClient(
+            backend="http-client",
+            server_url=url,
+            model_name=model_name or self.model_name,
+            skip_model_name_checking=True,
+            max_concurrency=self.max_inflight,
+            max_connections=self.max_inflight,
+            max_keepalive_connections=self.max_inflight,
+            keepalive_expiry=60,
+            http_timeout=self.http_timeout,
+            max_retries=0,
+            use_tqdm=False,
+        )
+
+    def _discover_model_name(self, urls):
+        """
+        未指定模型名时向第一个可达的端点查询 /v1/models
+        """
+        errors = []
+        for url in urls:
+            try:
+                with httpx.Client(timeout=10) as http:
+                    response = http.get(f"{url.rstrip('/')}/v1/models")
+                response.raise_for_status()
+                return response.json()["data"][0]["id"]
+            except Exception as e:
+                errors.append(f"{url}: {e}")
+        raise ServerError("无法从任何远程端点获取模型名: " + "; ".join(errors))
+
+    @property
+    def template(self):
+        """
+        任一端点的 MinerUClient，供构建客户端视图时读取 helper/prompts 等配置
+        """
+        return self.mineru_clients[0]
+
+    def __getattr__(self, name):
+        # prompt/system_prompt 等属性与各端点一致，转交第一个端点
+        if name.startswith("_") or name in ("mineru_clients",):
+            raise AttributeError(name)
+        return getattr(self._endpoints[0].client, name)
+
+    def _available(self, endpoint, now):
+        if endpoint.inflight >= self.max_inflight:
+            return False
+        if endpoint.ejected_until is None:
+            return True
+        # 冷却结束后只放行一个试探请求，成功才恢复
+        return now >= endpoint.ejected_until and endpoint.inflight == 0
+
+    def _acquire(self, tried):
+        """
+        选择在途请求最少的可用端点，优先选择本请求尚未失败过的端点；全部占满时等待
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                candidates = [endpoint for endpoint in self._endpoints if self._available(endpoint, now)]
+                fresh = [endpoint for endpoint in candidates if endpoint.url not in tried]
+                candidates = fresh or candidates
+                if candidates:
+                    endpoint = min(candidates, key=lambda e: (e.inflight, e.consecutive_failures, e.requests))
+                    endpoint.inflight += 1
+                    endpoint.requests += 1
+                    return endpoint
+                reopen_at = [e.ejected_until for e in self._endpoints if e.ejected_until is not None and e.inflight == 0]
+                timeout = max(0.05, min(reopen_at) - now) if reopen_at else None
+                self._cond.wait(timeout)
+
+    def _release(self, endpoint, ok):
+        with self._cond:
+            endpoint.inflight -= 1
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = None
+            else:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.ejected_until is not None or endpoint.consecutive_failures >= self.eject_after:
+                    endpoint.ejected_until = time.monotonic() + self.eject_seconds
+            self._cond.notify_all()
+
+    def predict(self, image, prompt="", sampling_params=None, priority=None):
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.0))
+            endpoint = self._acquire(tried)
+            try:
+                output = endpoint.client.predict(image, prompt, sampling_params, priority)
+            except RETRYABLE_ERRORS as e:
+                self._release(endpoint, ok=False)
+                tried.add(endpoint.url)
+                last_error = e
+                continue
+            except RequestError:
+                # 请求本身有误，换端点也无济于事
+                self._release(endpoint, ok=True)
+                raise
+            except Exception:
+                self._release(endpoint, ok=False)
+                raise
+            self._release(endpoint, ok=True)
+            return output
+        raise ServerError(f"远程推理在 {self.max_retries + 1} 次尝试后失败: {last_error}")
+
+    def batch_predict(self, images, prompts="", sampling_params=None, priority=None):
+        if isinstance(prompts, str):
+            prompts = [prompts] * len(images)
+        if not isinstance(sampling_params, (list, tuple)):
+            sampling_params = [sampling_params] * len(images)
+        if not isinstance(priority, (list, tuple)):
+            priority = [priority] * len(images)
+        if len(images) <= 1:
+            return [self.predict(*args) for args in zip(images, prompts, sampling_params, priority)]
+        # 同一批的请求并发发出，实际在途数由各端点的上限约束
+        workers = min(len(images), self.max_inflight * len(self._endpoints))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="remote-predict") as executor:
+            return list(executor.map(self.predict, images, prompts, sampling_params, priority))
+
+    def check_health(self):
+        """
+        向各端点的推理接口发一次单 token 请求（/v1/models 可用不代表能推理），
+        失败的端点立即摘除，恢复的端点重新启用；返回健康端点数
+        """
+        healthy = 0
+        probe_image = Image.new("RGB", (56, 56), "white")
+        probe_prompt = self.template.prompts["[default]"]
+        probe_params = MinerUSamplingParams(max_new_tokens=1)
+        for endpoint in self._endpoints:
+            try:
+                endpoint.client.predict(probe_image, probe_prompt, probe_params)
+                ok = True
+            except RequestError:
+                # 端点能正常应答，只是拒绝了探测请求本身
+                ok = True
+            except Exception:
+                ok = False
+            with self._cond:
+                if ok:
+                    endpoint.consecutive_failures = 0
+                    endpoint.ejected_until = None
+                    healthy += 1
+                else:
+                    endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                self._cond.notify_all()
+        return healthy
+
+    def stats(self):
+        """
+        各端点的在途请求数、累计请求/失败数和摘除状态
+        """
+        with self._cond:
+            now = time.monotonic()
+            return [
+                {
+                    "url": endpoint.url,
+                    "inflight": endpoint.inflight,
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                    "ejected": endpoint.ejected_until is not None and now < endpoint.ejected_until,
+                }
+                for endpoint in self._endpoints
+            ]
+
+
+def remote_client(endpoint_pool):
+    """
+    返回一个 MinerUClient 视图，其推理请求经由远程端点池发出
+    """
+    client = copy.copy(endpoint_pool.template)
+    client.client = endpoint_pool
+    return client
+
+
+def build_remote_client(server_urls, model_name=None):
+    """
+    按环境变量配置创建远程端点池，并返回使用它的 MinerUClient
+    """
+    return remote_client(RemoteEndpointPool.from_env(server_urls, model_name))
+
+
+def remote_health_check(client):
+    """
+    副本池健康检查: 远程端点全部不可用时视为失败
+    """
+    if not client.client.check_health():
+        raise ServerError("所有远程推理端点均不可用")
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持保活连接
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.model_name, "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": "not found"})
+            return
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.inflight += 1
+            server.max_inflight = max(server.max_inflight, server.inflight)
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            if random.random() < server.fail_rate:
+                self._send_json(503, {"error": "stub failure"})
+                return
+            text = "".join(
+                part.get("text", "")
+                for message in request.get("messages", []) if message.get("role") == "user"
+                for part in message.get("content", []) if isinstance(part, dict)
+            )
+            # 版面检测返回一个覆盖页面中部的文本块，其余请求返回固定文本
+            if "Layout Detection" in text:
+                content = "<|box_start|>100 100 900 900<|box_end|><|ref_start|>text<|ref_end|>"
+            else:
+                content = server.reply
+            self._send_json(200, {
+                "id": "stub",
+                "object": "chat.completion",
+                "model": server.model_name,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            })
+        finally:
+            with server.lock:
+                server.inflight -= 1
+
+
+class StubInferenceServer:
+    """
+    本地替身推理服务，模拟 OpenAI 兼容接口，用于在不加载权重的情况下测试远程后端
+    可配置响应延迟和失败率；port=0 时自动选择空闲端口
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, model_name="stub-mineru", latency=0.0, fail_rate=0.0, reply="stub text"):
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.model_name = model_name
+        self._server.latency = latency
+        self._server.fail_rate = fail_rate
+        self._server.reply = reply
+        self._server.lock = threading.Lock()
+        self._server.requests = 0
+        self._server.inflight = 0
+        self._server.max_inflight = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    @property
+    def max_inflight(self):
+        return self._server.max_inflight
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-inference-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地替身推理服务: 模拟 OpenAI 兼容的 MinerU 推理端点")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=30000)
+    parser.add_argument("--model-name", default="stub-mineru")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟耗时（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 503 的概率")
+    args = parser.parse_args()
+    server = StubInferenceServer(args.host, args.port, args.model_name, args.latency, args.fail_rate)
+    print(f"替身推理服务已启动: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from PIL import Image
+from mineru_vl_utils import MinerUSamplingParams
+
+
+def default_health_check(client):
+    """
+    用一张空白小图做一次单 token 推理，确认副本仍可用
+    """
+    client.client.predict(
+        Image.new("RGB", (56, 56), "white"),
+        client.prompts["[default]"],
+        MinerUSamplingParams(max_new_tokens=1),
+    )
+
+
+def is_replica_failure(error):
+    """
+    是否为副本本身的运行时故障（CUDA 错误、显存/内存不足等），只有这类异常才需要重建副本；
+    输入有误、后处理出错等异常与副本无关，副本照常归还
+    """
+    return isinstance(error, (RuntimeError, MemoryError)) and not isinstance(error, (NotImplementedError, RecursionError))
+
+
+class _Replica:
+    __slots__ = ("index", "client", "failures")
+
+    def __init__(self, index, client):
+        self.index = index
+        self.client = client
+        self.failures = 0
+
+
+class ReplicaPool:
+    """
+    MinerUClient 副本池
+    每个副本独立持有模型，借出/归还后由不同线程并行推理；抛出异常的副本在后台重建替换
+    """
+
+    def __init__(self, factory, size=1, torch_threads=None, health_check=default_health_check):
+        self.factory = factory  # 无参可调用，返回一个新的 MinerUClient
+        self.size = max(1, int(size))
+        # 各副本的 torch 线程预算，默认按CPU核数均分
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.size)
+        self.health_check = health_check
+        self.replacements = 0
+
+        self._idle = queue.Queue()
+        self._replicas = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._health_thread = None
+        self._health_stop = threading.Event()
+
+        for index in range(self.size):
+            replica = _Replica(index, factory())
+            self._replicas.append(replica)
+            self._idle.put(replica)
+
+    @staticmethod
+    def size_from_env(default=1):
+        return int(os.environ.get("OCR_REPLICAS", default))
+
+    @property
+    def template(self):
+        """
+        任一副本，供需要读取 helper/prompts 等配置的调用方使用
+        """
+        return self._replicas[0].client
+
+    def clients(self):
+        """
+        当前所有副本的客户端（含已借出的）
+        """
+        with self._lock:
+            return [replica.client for replica in self._replicas]
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        借出一个空闲副本，用完自动归还；推理中出现副本运行时故障时替换该副本，其他异常照常归还后抛出
+        """
+        try:
+            replica = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("等待空闲模型副本超时")
+        try:
+            self._apply_thread_budget()
+            yield replica.client
+        except BaseException as e:
+            if is_replica_failure(e):
+                replica.failures += 1
+                threading.Thread(target=self._replace, args=(replica,), daemon=True).start()
+            else:
+                self._idle.put(replica)
+            raise
+        else:
+            self._idle.put(replica)
+
+    def _apply_thread_budget(self):
+        import torch
+        if torch.get_num_threads() != self.torch_threads:
+            torch.set_num_threads(self.torch_threads)
+
+    def _replace(self, replica):
+        """
+        重建出错的副本；重建失败时保留原副本，避免池子缩小
+        """
+        try:
+            new_replica = _Replica(replica.index, self.factory())
+        except Exception:
+            new_replica = replica
+        with self._lock:
+            if self._closed:
+                return
+            self._replicas[replica.index] = new_replica
+            if new_replica is not replica:
+                self.replacements += 1
+        self._idle.put(new_replica)
+
+    def check_health(self):
+        """
+        检查当前空闲的副本，返回被替换的副本数
+        """
+        if self.health_check is None:
+            return 0
+        replaced = 0
+        for _ in range(self._idle.qsize()):
+            try:
+                replica = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.health_check(replica.client)
+            except Exception:
+                replica.failures += 1
+                self._replace(replica)
+                replaced += 1
+            else:
+                self._idle.put(replica)
+        return replaced
+
+    def start_health_checks(self, interval=60):
+        """
+        启动后台线程定期做健康检查
+        """
+        def run():
+            while not self._health_stop.wait(interval):
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=run, name="replica-health-check", daemon=True)
+        self._health_thread.start()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._health_stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
@@ -0,0 +1,310 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from distributed_ocr import file_digest
+
+DEFAULT_INDEX_PATH = os.environ.get("OCR_SEARCH_INDEX", os.path.join("output", "search_index.db"))
+
+# 结果中高亮命中词的标记（Markdown 加粗）
+HIGHLIGHT = ("**", "**")
+SNIPPET_CHARS = 40
+
+
+def _trigram_supported():
+    # trigram 分词器（SQLite 3.34+）支持中文等无空格文本的子串检索
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE t USING fts5(a, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+class SearchIndex:
+    """
+    基于 SQLite FTS5 的全文索引，按页写入识别块文本
+    文档以源文件内容的 sha1 标识，重新识别同一文件时写入新版本，完成后替换旧条目，不会重复
+    """
+
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    source_name TEXT NOT NULL,
+                    output_path TEXT,
+                    page_count INTEGER,
+                    indexed_at REAL
+                )
+            """)
+            existing = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'blocks'").fetchone()
+            if existing is None:
+                tokenizer = "trigram" if _trigram_supported() else "unicode61"
+                conn.execute(
+                    "CREATE VIRTUAL TABLE blocks USING fts5("
+                    f"content, doc_id UNINDEXED, page UNINDEXED, block_type UNINDEXED, tokenize='{tokenizer}')"
+                )
+                self.tokenizer = tokenizer
+            else:
+                self.tokenizer = "trigram" if "trigram" in existing[0] else "unicode61"
+            # FTS5 的 UNINDEXED 列无法按条件快速定位，另建普通表记录每页的行号和所属版本，按行号删除旧条目
+            # 旧索引首次打开时补建缺少的表和列，已有条目视为第 0 版
+            conn.execute("BEGIN IMMEDIATE")
+            document_columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+            if "generation" not in document_columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN generation INTEGER")
+                conn.execute("ALTER TABLE documents ADD COLUMN staging_generation INTEGER")
+                conn.execute("UPDATE documents SET generation = 0 WHERE indexed_at IS NOT NULL")
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'block_pages'").fetchone() is None:
+                conn.execute(
+                    "CREATE TABLE block_pages (block_rowid INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, "
+                    "page INTEGER NOT NULL, generation INTEGER NOT NULL DEFAULT 0)"
+                )
+                conn.execute("INSERT INTO block_pages (block_rowid, doc_id, page) SELECT rowid, doc_id, page FROM blocks")
+            elif "generation" not in {row[1] for row in conn.execute("PRAGMA table_info(block_pages)")}:
+                conn.execute("ALTER TABLE block_pages ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+            conn.execute("DROP INDEX IF EXISTS block_pages_doc_page")
+            conn.execute("CREATE INDEX IF NOT EXISTS block_pages_doc_generation ON block_pages (doc_id, generation, page)")
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _connect(self):
+        # 每次操作使用独立连接，Web 界面的多个任务线程可共享同一个索引对象
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _delete_blocks(conn, condition, params):
+        rowids = conn.execute(f"SELECT block_rowid FROM block_pages WHERE {condition}", params).fetchall()
+        conn.executemany("DELETE FROM blocks WHERE rowid = ?", rowids)
+        conn.execute(f"DELETE FROM block_pages WHERE {condition}", params)
+
+    @staticmethod
+    def document_id(file_path):
+        """
+        源文件存在时取内容哈希，否则取路径的哈希
+        """
+        if os.path.isfile(file_path):
+            return file_digest(file_path)
+        return hashlib.sha1(file_path.encode("utf-8")).hexdigest()
+
+    def begin_document(self, file_path, source_name=None):
+        """
+        登记文档并开始一个新的暂存版本，返回文档ID，之后逐页调用 index_page
+        新版本在 finish_document 之前不可检索，已完成的旧版本在此期间保持可检索；中途失败时旧版本保留
+        """
+        doc_id = self.document_id(file_path)
+        with self._transaction() as conn:
+            # 清除上次未完成的暂存版本
+            self._delete_blocks(
+                conn, "doc_id = ? AND generation != COALESCE((SELECT generation FROM documents WHERE doc_id = ?), -1)",
+                (doc_id, doc_id),
+            )
+            conn.execute(
+                "INSERT INTO documents (doc_id, source_name, staging_generation) VALUES (?, ?, 0) "
+                "ON CONFLICT(doc_id) DO UPDATE SET source_name = excluded.source_name, "
+                "  staging_generation = COALESCE(generation, -1) + 1",
+                (doc_id, source_name or os.path.basename(file_path)),
+            )
+        return doc_id
+
+    def index_page(self, doc_id, page, blocks):
+        """
+        把一页（页码从1开始）的识别块写入暂存版本，重复写入同一页会覆盖
+        """
+        rows = [
+            (block.get("content").strip(), doc_id, page, block.get("type", "unknown"))
+            for block in blocks
+            if block.get("content") and block.get("content").strip()
+        ]
+        with self._transaction() as conn:
+            generation = conn.execute(
+                "SELECT staging_generation FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+            if generation is None or generation[0] is None:
+                raise RuntimeError(f"文档 {doc_id} 没有进行中的索引，请先调用 begin_document")
+            generation = generation[0]
+            self._delete_blocks(conn, "doc_id = ? AND generation = ? AND page = ?", (doc_id, generation, page))
+            for row in rows:
+                rowid = conn.execute("INSERT INTO blocks (content, doc_id, page, block_type) VALUES (?, ?, ?, ?)", row).lastrowid
+                conn.execute(
+                    "INSERT INTO block_pages (block_rowid, doc_id, page, generation) VALUES (?, ?, ?, ?)",
+                    (rowid, doc_id, page, generation),
+                )
+
+    def finish_document(self, doc_id, output_path=None, page_count=None):
+        """
+        用暂存版本替换已完成的旧版本，使其可检索
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE documents SET generation = staging_generation, staging_generation = NULL, "
+                "  output_path = ?, page_count = ?, indexed_at = ? "
+                "WHERE doc_id = ? AND staging_generation IS NOT NULL",
+                (output_path, page_count, time.time(), doc_id),
+            )
+            self._delete_blocks(
+                conn, "doc_id = ? AND generation != (SELECT generation FROM documents WHERE doc_id = ?)", (doc_id, doc_id)
+            )
+
+    def discard_document(self, doc_id):
+        """
+        放弃进行中的暂存版本（识别失败或取消），已完成的旧版本不受影响
+        """
+        with self._transaction() as conn:
+            self._delete_blocks(
+                conn, "doc_id = ? AND generation = (SELECT staging_generation FROM documents WHERE doc_id = ?)",
+                (doc_id, doc_id),
+            )
+            conn.execute("UPDATE documents SET staging_generation = NULL WHERE doc_id = ?", (doc_id,))
+            # 从未完成过的文档不保留记录
+            conn.execute("DELETE FROM documents WHERE doc_id = ? AND generation IS NULL", (doc_id,))
+
+    def index_document(self, file_path, pages, output_path=None, source_name=None):
+        """
+        一次性索引整个文档，pages 为按页排列的识别块列表
+        """
+        doc_id = self.begin_document(file_path, source_name)
+        for page, blocks in enumerate(pages, 1):
+            self.index_page(doc_id, page, blocks)
+        self.finish_document(doc_id, output_path, len(pages))
+        return doc_id
+
+    def index_jsonl(self, jsonl_path):
+        """
+        从结构化导出（structured_export.py 的 JSONL）建立索引，返回索引的文档数
+        """
+        documents = {}
+        with open(jsonl_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    pages = documents.setdefault(record["source"], {})
+                    pages.setdefault(record["page"], []).append(record)
+        for source, pages in documents.items():
+            doc_id = self.begin_document(source)
+            for page, records in pages.items():
+                self.index_page(doc_id, page, sorted(records, key=lambda record: record["block_index"]))
+            self.finish_document(doc_id, jsonl_path, max(pages))
+        return len(documents)
+
+    def _manual_snippet(self, content, terms):
+        lowered = content.lower()
+        position = min((lowered.find(term.lower()) for term in terms if term.lower() in lowered), default=0)
+        start = max(0, position - SNIPPET_CHARS // 2)
+        snippet = content[start:start + SNIPPET_CHARS]
+        for term in terms:
+            index = snippet.lower().find(term.lower())
+            if index >= 0:
+                snippet = snippet[:index] + HIGHLIGHT[0] + snippet[index:index + len(term)] + HIGHLIGHT[1] + snippet[index + len(term):]
+        return ("…" if start > 0 else "") + snippet + ("…" if start + SNIPPET_CHARS < len(content) else "")
+
+    def search(self, query, limit=20):
+        """
+        检索，多个词以空格分隔且需同时命中；返回按相关度排序的 [{source_name, page, block_type, snippet, output_path, doc_id}]
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        columns = "d.source_name, b.page, b.block_type, d.output_path, b.doc_id"
+        # 只检索已完成的版本，进行中的暂存版本不可见
+        live = (
+            "JOIN block_pages p ON p.block_rowid = b.rowid "
+            "JOIN documents d ON d.doc_id = p.doc_id AND d.generation = p.generation"
+        )
+        with self._connect() as conn:
+            if self.tokenizer != "trigram" or all(len(term) >= 3 for term in terms):
+                match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+                rows = conn.execute(
+                    f"SELECT {columns}, snippet(blocks, 0, ?, ?, '…', 32) FROM blocks b "
+                    f"{live} WHERE blocks MATCH ? ORDER BY bm25(blocks) LIMIT ?",
+                    (*HIGHLIGHT, match, limit),
+                ).fetchall()
+            else:
+                # trigram 无法匹配少于3个字符的词（如两个汉字），退回子串扫描
+                conditions = " AND ".join("b.content LIKE ? ESCAPE '\\'" for _ in terms)
+                patterns = ["%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%" for term in terms]
+                rows = [
+                    (*row[:5], self._manual_snippet(row[5], terms))
+                    for row in conn.execute(
+                        f"SELECT {columns}, b.content FROM blocks b {live} "
+                        f"WHERE {conditions} ORDER BY d.indexed_at DESC, b.page LIMIT ?",
+                        (*patterns, limit),
+                    )
+                ]
+        return [
+            {
+                "source_name": source_name,
+                "page": page,
+                "block_type": block_type,
+                "output_path": output_path,
+                "doc_id": doc_id,
+                "snippet": snippet.replace("\n", " "),
+            }
+            for source_name, page, block_type, output_path, doc_id, snippet in rows
+        ]
+
+    def stats(self):
+        with self._connect() as conn:
+            return {
+                "documents": conn.execute("SELECT COUNT(*) FROM documents WHERE generation IS NOT NULL").fetchone()[0],
+                "blocks": conn.execute(
+                    "SELECT COUNT(*) FROM block_pages p JOIN documents d ON d.doc_id = p.doc_id AND d.generation = p.generation"
+                ).fetchone()[0],
+                "tokenizer": self.tokenizer,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR结果全文检索")
+    parser.add_argument("--db", default=DEFAULT_INDEX_PATH, help="索引数据库路径")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search_parser = subparsers.add_parser("search", help="检索")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=20)
+    index_parser = subparsers.add_parser("index-jsonl", help="从结构化导出的 JSONL 文件建立索引")
+    index_parser.add_argument("paths", nargs="+")
+    subparsers.add_parser("stats", help="查看索引规模")
+    args = parser.parse_args()
+
+    index = SearchIndex(args.db)
+    if args.command == "search":
+        start = time.perf_counter()
+        hits = index.search(args.query, args.limit)
+        for hit in hits:
+            print(f"{hit['source_name']}  第 {hit['page']} 页  [{hit['block_type']}]  {hit['snippet']}")
+        print(f"共 {len(hits)} 条，耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    elif args.command == "index-jsonl":
+        for path in args.paths:
+            print(f"{path}: 索引 {index.index_jsonl(path)} 个文档")
+    else:
+        print(json.dumps(index.stats(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
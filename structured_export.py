@@ -0,0 +1,148 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import json
+import os
+import threading
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ARROW_SUPPORT = True
+except ImportError:
+    ARROW_SUPPORT = False
+
+EXPORT_FORMATS = ("jsonl", "parquet", "arrow")
+
+# 每条记录对应一个识别块；bbox 为相对页面宽高的 0~1 坐标
+RECORD_FIELDS = (
+    "source", "page", "block_index", "type",
+    "x0", "y0", "x1", "y1", "angle", "content", "page_seconds",
+)
+
+
+def block_records(blocks, source, page, page_seconds=None):
+    """
+    把一页的识别块转为扁平记录，page 从1开始，page_seconds 为该页识别耗时
+    """
+    records = []
+    for block_index, block in enumerate(blocks):
+        bbox = block.get("bbox") or (None, None, None, None)
+        records.append({
+            "source": source,
+            "page": page,
+            "block_index": block_index,
+            "type": block.get("type", "unknown"),
+            "x0": bbox[0],
+            "y0": bbox[1],
+            "x1": bbox[2],
+            "y1": bbox[3],
+            "angle": block.get("angle"),
+            "content": block.get("content"),
+            "page_seconds": page_seconds,
+        })
+    return records
+
+
+class JsonlExporter:
+    """
+    逐页追加 JSONL 记录，每页写完即刷新到磁盘
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write_page(self, blocks, source, page, page_seconds=None):
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in block_records(blocks, source, page, page_seconds))
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArrowExporter:
+    """
+    列式导出（Parquet 或 Arrow IPC 文件），记录攒够 rows_per_batch 条写出一个行组/记录批
+    需要安装 pyarrow
+    """
+
+    def __init__(self, path, file_format="parquet", rows_per_batch=4096):
+        if not ARROW_SUPPORT:
+            raise ImportError("pyarrow未安装，无法导出 Parquet/Arrow，请运行: pip install pyarrow")
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError(f"未知的列式格式: {file_format}")
+        self.path = path
+        self.file_format = file_format
+        self.rows_per_batch = max(1, int(rows_per_batch))
+        self.schema = pa.schema([
+            ("source", pa.string()),
+            ("page", pa.int32()),
+            ("block_index", pa.int32()),
+            ("type", pa.string()),
+            ("x0", pa.float32()),
+            ("y0", pa.float32()),
+            ("x1", pa.float32()),
+            ("y1", pa.float32()),
+            ("angle", pa.int16()),
+            ("content", pa.string()),
+            ("page_seconds", pa.float32()),
+        ])
+        if file_format == "parquet":
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def write_page(self, blocks, source, page, page_seconds=None):
+        with self._lock:
+            self._buffer.extend(block_records(blocks, source, page, page_seconds))
+            if len(self._buffer) >= self.rows_per_batch:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        columns = {name: [record[name] for record in self._buffer] for name in RECORD_FIELDS}
+        batch = pa.RecordBatch.from_pydict(columns, schema=self.schema)
+        self._writer.write_batch(batch)
+        self._buffer = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_exporter(path, file_format=None):
+    """
+    按格式（缺省由扩展名推断: .jsonl / .parquet / .arrow）创建导出器
+    """
+    if file_format is None:
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        file_format = {"feather": "arrow", "ndjson": "jsonl"}.get(ext, ext)
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"未知的导出格式: {file_format}，可选: {', '.join(EXPORT_FORMATS)}")
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    if file_format == "jsonl":
+        return JsonlExporter(path)
+    return ArrowExporter(path, file_format)
@@ -0,0 +1,372 @@
+"""
+@license AGPL-3.0
+Copyright (c) 2025 ShatteredCross. All rights reserved.
+"""
+import argparse
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+from datetime import datetime
+from PIL import Image
+
+from distributed_ocr import SUPPORTED_EXTENSIONS, load_client
+from file_utils import atomic_write_text
+from job_scheduler import pdf_page_count, render_pdf_page
+from region_cache import RegionCache
+from remote_backend import is_remote_spec
+from search_index import DEFAULT_INDEX_PATH, SearchIndex
+from structured_export import EXPORT_FORMATS, open_exporter
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_SUPPORT = True
+except ImportError:
+    WATCHDOG_SUPPORT = False
+
+# 下载器/拷贝工具写入中的临时文件后缀
+PARTIAL_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload", ".download", "~")
+
+
+def is_candidate(file_path):
+    name = os.path.basename(file_path)
+    if name.startswith(".") or name.lower().endswith(PARTIAL_SUFFIXES):
+        return False
+    return os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def looks_complete(file_path):
+    """
+    按格式检查文件是否完整: PDF 末尾应有 %%EOF，图片应能通过校验
+    """
+    if os.path.splitext(file_path)[1].lower() == ".pdf":
+        with open(file_path, "rb") as f:
+            f.seek(max(0, os.path.getsize(file_path) - 1024))
+            return b"%%EOF" in f.read()
+    try:
+        with Image.open(file_path) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def move_aside(file_path, target_dir):
+    """
+    把输入文件移到 processed/ 或 failed/，重名时追加时间戳
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    target = os.path.join(target_dir, os.path.basename(file_path))
+    if os.path.exists(target):
+        stem, ext = os.path.splitext(os.path.basename(file_path))
+        target = os.path.join(target_dir, f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}{ext}")
+    shutil.move(file_path, target)
+    return target
+
+
+class FolderWatcher:
+    """
+    监视输入目录，文件大小和修改时间在 settle_seconds 内不再变化、且格式完整才视为写入完成并放入队列；
+    停止变化超过 incomplete_timeout 仍不完整的文件也会放入队列，由处理流程判为失败
+    安装了 watchdog 时由 inotify 等系统事件驱动，否则定期轮询目录
+    """
+
+    def __init__(self, input_dir, ready_queue, settle_seconds=1.0, poll_interval=1.0, use_events=True,
+                 incomplete_timeout=60):
+        self.input_dir = os.path.abspath(input_dir)
+        self.ready_queue = ready_queue
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.incomplete_timeout = incomplete_timeout
+        self.use_events = use_events and WATCHDOG_SUPPORT
+
+        self._pending = {}  # 路径 -> (大小, 修改时间, 首次观察到该状态的时间)
+        self._enqueued = set()  # 已入队但尚未移走的文件，避免重复处理
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+
+    @property
+    def mode(self):
+        return "inotify" if self.use_events else "polling"
+
+    def notify(self, file_path):
+        """
+        标记文件有变化（文件系统事件回调）
+        """
+        if is_candidate(file_path):
+            with self._lock:
+                self._pending.setdefault(os.path.abspath(file_path), None)
+            self._wakeup.set()
+
+    def release(self, file_path):
+        """
+        文件已被移出输入目录，允许同名新文件再次入队
+        """
+        with self._lock:
+            self._enqueued.discard(os.path.abspath(file_path))
+
+    def _scan(self):
+        for name in os.listdir(self.input_dir):
+            file_path = os.path.join(self.input_dir, name)
+            if os.path.isfile(file_path):
+                self.notify(file_path)
+
+    def _check_pending(self):
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for file_path, seen in list(self._pending.items()):
+                if file_path in self._enqueued:
+                    del self._pending[file_path]
+                    continue
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    del self._pending[file_path]
+                    continue
+                state = (stat.st_size, stat.st_mtime_ns)
+                if seen is None or seen[:2] != state:
+                    self._pending[file_path] = (*state, now)
+                elif stat.st_size > 0 and now - seen[2] >= self.settle_seconds:
+                    if now - seen[2] < self.incomplete_timeout and not looks_complete(file_path):
+                        continue
+                    del self._pending[file_path]
+                    self._enqueued.add(file_path)
+                    ready.append(file_path)
+        for file_path in ready:
+            # 队列已满时阻塞，文件留在输入目录中等待（背压）
+            while not self._stop.is_set():
+                try:
+                    self.ready_queue.put(file_path, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def _has_pending(self):
+        with self._lock:
+            return bool(self._pending)
+
+    def run(self):
+        os.makedirs(self.input_dir, exist_ok=True)
+        if self.use_events:
+            handler = _EventHandler(self)
+            self._observer = Observer()
+            self._observer.schedule(handler, self.input_dir, recursive=False)
+            self._observer.start()
+        # 启动前已存在的文件同样处理
+        self._scan()
+        while not self._stop.is_set():
+            if not self.use_events:
+                self._scan()
+            self._check_pending()
+            if self.use_events and not self._has_pending():
+                # 事件模式下空闲时等待下一次文件事件
+                self._wakeup.wait(self.poll_interval * 10)
+            else:
+                self._wakeup.wait(min(self.poll_interval, self.settle_seconds / 4 or self.poll_interval))
+            self._wakeup.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+
+if WATCHDOG_SUPPORT:
+    class _EventHandler(FileSystemEventHandler):
+        def __init__(self, watcher):
+            self.watcher = watcher
+
+        def on_created(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.src_path)
+
+        def on_modified(self, event):
+            if not event.is_directory:
+                self.watcher.notify(event.src_path)
+
+        def on_moved(self, event):
+            # 写入临时文件后改名是常见的原子写法，以新文件名为准
+            if not event.is_directory:
+                self.watcher.notify(event.dest_path)
+
+
+class WatchFolderDaemon:
+    """
+    监视目录守护进程: 模型只加载一次，常驻处理新放入的PDF和图片
+    结果原子写入输出目录，输入文件随后移到 processed/，失败的移到 failed/ 并附带错误信息
+    """
+
+    def __init__(self, client, input_dir="input", output_dir="output", processed_dir="processed",
+                 failed_dir="failed", queue_size=16, workers=1, settle_seconds=1.0, poll_interval=1.0, use_events=True,
+                 export_format=None, search_index=None):
+        self.client = client
+        self.export_format = export_format  # 可选的结构化导出格式: jsonl / parquet / arrow
+        self.search_index = search_index  # 可选的全文索引，每页识别完成即写入
+        self.output_dir = output_dir
+        self.processed_dir = processed_dir
+        self.failed_dir = failed_dir
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.watcher = FolderWatcher(input_dir, self.queue, settle_seconds, poll_interval, use_events)
+        self.workers = max(1, int(workers))
+        self.processed = 0
+        self.failed = 0
+        self._threads = []
+
+    def process_document(self, file_path):
+        """
+        识别单个文档并原子写出 Markdown，返回输出路径
+        开启结构化导出时逐页写入同名的临时导出文件，全部完成后再改名
+        """
+        from basic_demo import generate_formatted_markdown, process_single_image
+
+        original_name = os.path.splitext(os.path.basename(file_path))[0]
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        is_pdf = os.path.splitext(file_path)[1].lower() == ".pdf"
+        stem = f"{original_name}_[OCR_Multipage]_{timestamp}" if is_pdf else f"{original_name}_[OCR]_{timestamp}"
+
+        doc_id = self.search_index.begin_document(file_path) if self.search_index is not None else None
+        exporter = None
+        if self.export_format:
+            os.makedirs(self.output_dir, exist_ok=True)
+            export_path = os.path.join(self.output_dir, f"{stem}.{self.export_format}")
+            exporter = open_exporter(os.path.join(self.output_dir, f".{stem}.partial"), self.export_format)
+        try:
+            if is_pdf:
+                region_cache = RegionCache()
+                pages = []
+                for page_num in range(1, pdf_page_count(file_path) + 1):
+                    page_start = time.perf_counter()
+                    pages.append(process_single_image(
+                        render_pdf_page(file_path, page_num), self.client, region_cache,
+                        page_label=f"{os.path.basename(file_path)} 第 {page_num} 页",
+                    ))
+                    if exporter is not None:
+                        exporter.write_page(pages[-1], file_path, page_num, time.perf_counter() - page_start)
+                    if doc_id is not None:
+                        self.search_index.index_page(doc_id, page_num, pages[-1])
+                md_content = generate_formatted_markdown(pages, original_name, multipage=True)
+            else:
+                page_start = time.perf_counter()
+                blocks = process_single_image(file_path, self.client)
+                if exporter is not None:
+                    exporter.write_page(blocks, file_path, 1, time.perf_counter() - page_start)
+                if doc_id is not None:
+                    self.search_index.index_page(doc_id, 1, blocks)
+                md_content = generate_formatted_markdown(blocks, original_name, multipage=False)
+        except BaseException:
+            # 识别失败时放弃本次写入的索引条目，之前完成的索引保持不变
+            if doc_id is not None:
+                self.search_index.discard_document(doc_id)
+            raise
+        finally:
+            if exporter is not None:
+                exporter.close()
+        if exporter is not None:
+            os.replace(exporter.path, export_path)
+        output_path = os.path.join(self.output_dir, f"{stem}.md")
+        atomic_write_text(output_path, md_content)
+        if doc_id is not None:
+            self.search_index.finish_document(doc_id, output_path, len(pages) if is_pdf else 1)
+        return output_path
+
+    def _archive(self, file_path, target_dir, error=None):
+        """
+        把输入文件移出输入目录（失败时附带错误信息）；文件在处理期间被删除或改名等导致移动失败时
+        只记录日志，不中断工作线程
+        """
+        try:
+            target = move_aside(file_path, target_dir)
+            if error is not None:
+                atomic_write_text(target + ".error.txt", error)
+            return target
+        except Exception as e:
+            print(f"移动输入文件失败: {file_path} -> {target_dir}: {e!r}")
+            return None
+
+    def _worker(self):
+        while True:
+            file_path = self.queue.get()
+            if file_path is None:
+                return
+            start = time.perf_counter()
+            try:
+                output_path = self.process_document(file_path)
+            except Exception:
+                error = traceback.format_exc()
+                target = self._archive(file_path, self.failed_dir, error)
+                self.failed += 1
+                print(f"识别失败: {os.path.basename(file_path)} -> {target or file_path}\n{error}")
+            else:
+                self._archive(file_path, self.processed_dir)
+                self.processed += 1
+                print(f"已完成: {os.path.basename(file_path)} -> {output_path} ({time.perf_counter() - start:.1f}s)")
+            finally:
+                self.watcher.release(file_path)
+
+    def start(self):
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"watch-folder-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        self._threads.append(threading.Thread(target=self.watcher.run, name="watch-folder", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """
+        停止监视，等待已入队的文件处理完毕
+        """
+        self.watcher.stop()
+        for _ in range(self.workers):
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监视目录守护进程: 自动识别放入输入目录的PDF和图片")
+    parser.add_argument("--model", required=True, help="模型文件夹路径或远程推理端点地址")
+    parser.add_argument("--cpu-profile", default=None, help="CPU推理配置（见 cpu_profile.py）")
+    parser.add_argument("--input", default="input")
+    parser.add_argument("--output", default="output")
+    parser.add_argument("--processed", default="processed", help="处理成功的输入文件移到此目录")
+    parser.add_argument("--failed", default="failed", help="处理失败的输入文件移到此目录")
+    parser.add_argument("--queue-size", type=int, default=16, help="待处理队列上限")
+    parser.add_argument("--workers", type=int, default=1, help="处理线程数（仅远程推理时可大于1）")
+    parser.add_argument("--settle", type=float, default=1.0, help="文件停止变化多少秒后视为写入完成")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--polling", action="store_true", help="不使用文件系统事件，强制轮询")
+    parser.add_argument("--export-format", choices=EXPORT_FORMATS, default=None, help="同时输出结构化块记录")
+    parser.add_argument("--search-index", default=DEFAULT_INDEX_PATH, help="全文索引数据库路径")
+    parser.add_argument("--no-index", action="store_true", help="不写入全文索引")
+    args = parser.parse_args()
+    # 本地模型只有一份，多个线程同时调用 generate 不安全
+    if args.workers > 1 and not is_remote_spec(args.model):
+        parser.error("--workers 大于1 仅支持远程推理端点，本地模型请使用 1 个处理线程")
+
+    client = load_client(args.model, args.cpu_profile)
+    daemon = WatchFolderDaemon(
+        client, args.input, args.output, args.processed, args.failed,
+        queue_size=args.queue_size, workers=args.workers, settle_seconds=args.settle,
+        poll_interval=args.poll_interval, use_events=not args.polling, export_format=args.export_format,
+        search_index=None if args.no_index else SearchIndex(args.search_index),
+    ).start()
+    print(f"正在监视 {os.path.abspath(args.input)}（{daemon.watcher.mode}），按 Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,24 +4,48 @@ Copyright (c) 2025 ShatteredCross. All rights reserved.
 """
 from datetime import datetime
 import os
-import tempfile
 import shutil
+import tempfile
+import time
+import uuid
+import zipfile
 from pathlib import Path
 import gradio as gr
 from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
 from PIL import Image
 from mineru_vl_utils import MinerUClient
+from region_cache import RegionCache, cached_two_step_extract
+from inference_scheduler import InferenceScheduler
+from replica_pool import ReplicaPool
+from model_registry import ModelNotResident, ModelRegistry
+from cpu_profile import CPU_PROFILES, configured_intra_op_threads, load_cpu_model
+from remote_backend import RemoteEndpointPool, is_remote_spec, remote_client, remote_health_check
+from search_index import SearchIndex
+from image_preprocess import ImagePreprocessor
+from prefix_cache import PrefixKVCache, enable_prefix_cache
+from autotune import autotune_model
+from job_scheduler import PDF_SUPPORT, PageJob, PageScheduler, document_page_count, estimate_page_cost, render_pdf_page
+
+# 模型副本的健康检查间隔（秒）
+HEALTH_CHECK_INTERVAL = float(os.environ.get("OCR_HEALTH_CHECK_INTERVAL", 300))
+
+# 同时处理的OCR任务数，各任务的推理请求由所用模型的推理调度器合批执行
+MAX_CONCURRENT_JOBS = int(os.environ.get("OCR_MAX_CONCURRENT_JOBS", 4))
+
+# 页粒度调度器，小任务不必排在大PDF的全部页面之后
+global_page_scheduler = PageScheduler.from_env(default_workers=MAX_CONCURRENT_JOBS)
+
+# 全文索引，识别结果按页写入（路径见 OCR_SEARCH_INDEX）
+global_search_index = SearchIndex()
+
+# 推理前的图像预处理（步骤见 OCR_PREPROCESS，缺省不启用）
+global_preprocessor = ImagePreprocessor.from_env()
 
-# 全局变量，用于保存模型和客户端
-global_model = None
-global_processor = None
-global_client = None
+# 提示词前缀的KV缓存，所有本地模型副本共用同一内存上限（见 OCR_PREFIX_CACHE_MB）
+global_prefix_cache = PrefixKVCache.from_env()
 
-try:
-    from pdf2image import convert_from_path
-    PDF_SUPPORT = True
-except ImportError:
-    PDF_SUPPORT = False
+# 可识别的文件类型；上传的 zip 压缩包中只解压这些文件
+SUPPORTED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.bmp')
 
 # 多语言文本定义
 TEXTS = {
@@ -29,9 +53,14 @@ TEXTS = {
         "title": "PDF OCR based on MinerU2.5-1.2B",
         "subtitle": "基于 MinerU2.5-1.2B OCR 大模型的 PDF 和图片文档识别工具",
         "model_path_label": "模型路径",
-        "model_path_placeholder": "请输入模型文件夹的绝对路径...（如为Docker,输入 /app/checkpoints ）",
+        "model_path_placeholder": "请输入模型文件夹的绝对路径...（如为Docker,输入 /app/checkpoints ；远程推理服务输入逗号分隔的 http:// 地址）",
+        "replica_count_label": "模型副本数",
+        "cpu_profile_label": "CPU推理配置",
+        "cpu_profile_auto": "自动（不启用CPU优化）",
+        "autotune_label": "自动调优批大小与副本数（副本数作为上限，结果按本机保存）",
         "load_model_btn": "加载模型",
         "file_input_label": "上传文件",
+        "model_select_label": "识别模型",
         "process_btn": "开始OCR识别",
         "status_output_label": "处理状态",
         "result_output_label": "识别结果 (Markdown格式)",
@@ -40,14 +69,15 @@ TEXTS = {
         "instructions": [
             "1. **设置模型路径**: 输入 `MinerU2.5-1.2B` 模型文件夹的绝对路径（如为Docker,输入 /app/checkpoints ）",
             "2. **点击加载模型**: 等待模型加载完成（状态栏显示成功）",
-            "3. **上传文件**: 支持 PDF、JPG、JPEG、PNG、BMP 格式",
+            "3. **上传文件**: 支持 PDF、JPG、JPEG、PNG、BMP 格式，可一次上传多个文件或zip压缩包",
             "4. **开始识别**: 点击开始OCR识别按钮，等待处理完成",
-            "5. **查看结果**: 在右侧查看识别结果和下载Markdown文件"
+            "5. **查看结果**: 在右侧查看识别结果和下载Markdown文件（多个文件打包为zip）"
         ],
         "supported_formats_title": "支持的格式",
         "supported_formats": [
             "PDF 文档（多页自动处理）",
-            "图片文件: JPG, JPEG, PNG, BMP"
+            "图片文件: JPG, JPEG, PNG, BMP",
+            "zip 压缩包（内含上述文件）"
         ],
         "notes_title": "注意事项",
         "notes": [
@@ -57,37 +87,59 @@ TEXTS = {
         "language_btn": "English",
         # 新增的状态和错误信息
         "model_not_loaded": "❌ 请先加载模型！点击上方的'加载模型'按钮完成模型初始化后再进行OCR识别。",
+        "model_not_resident": "❌ 所选模型已被卸载，请重新加载或选择其他模型。",
         "no_file_uploaded": "❌ 请先上传要识别的文件！",
         "pdf_not_supported": "❌ PDF支持未启用，请安装pdf2image: pip install pdf2image",
         "unsupported_format": "❌ 不支持的文件格式 {file_ext}",
-        "file_detected": "📄 检测到文件: {filename}",
-        "pdf_detected": "🔄 检测到PDF文件，开始转换...",
-        "pdf_converted": "✅ PDF转换完成，共 {page_count} 页",
-        "image_detected": "🖼️ 检测到图片文件，开始处理...",
-        "page_processed": "✅ 第 {page_num} 页处理完成",
-        "image_processed": "✅ 图片处理完成",
-        "ocr_completed": "✅ OCR处理完成! 结果保存在: {filename}",
+        "no_supported_files": "❌ 上传的文件（含压缩包内）中没有可识别的PDF或图片",
+        "batch_queued": "⏳ 共 {count} 个文档、{pages} 页，已加入调度队列",
+        "job_waiting": "排队等待中...",
+        "file_waiting": "🕒 {filename}: 排队中（共 {total} 页）",
+        "file_progress": "🔄 {filename}: 已完成 {done}/{total} 页",
+        "file_completed": "✅ {filename} -> {output}",
+        "file_failed": "❌ {filename}: {error}",
+        "region_cache_stats": "♻️ 页眉/页脚复用 {hits} 次，识别 {misses} 次",
+        "batch_completed": "✅ OCR处理完成! 成功 {succeeded} 个，失败 {failed} 个，结果保存在: {filename}",
+        "batch_failed": "❌ 所有文档均处理失败",
         "processing_error": "❌ 处理过程中发生错误: {error}",
         "model_loading": "正在加载模型...",
-        "processor_loading": "正在加载处理器...",
-        "client_initializing": "正在初始化客户端...",
+        "replica_loading": "正在加载模型副本 {index}/{total}...",
         "model_loaded": "模型加载完成",
         "model_load_success": "✅ 模型加载成功！",
+        "runtime_settings": "⚙️ 批大小 {batch_size}，副本数 {replicas}",
         "model_path_not_exist": "❌ 错误: 模型路径不存在",
         "model_load_failed": "❌ 模型加载失败: {error}",
-        "pdf_converting": "正在转换PDF为图片...",
-        "processing_page": "正在处理第 {page_num} 页...",
-        "processing_image": "正在处理图片...",
-        "generating_markdown": "正在生成Markdown文件...",
-        "processing_complete": "处理完成"
+        "batch_progress": "正在处理: 已完成 {done}/{total} 页...",
+        "creating_archive": "正在打包结果文件...",
+        "processing_complete": "处理完成",
+        "scheduler_stats_label": "调度统计",
+        "refresh_stats_btn": "刷新统计",
+        "scheduler_stats_header": "调度策略: {policy}，进行中任务: {active_jobs}",
+        "scheduler_stats_line": "[{size_class}] 任务数 {jobs}，平均排队 {mean_wait:.1f}s，P50 耗时 {p50_latency:.1f}s，P95 耗时 {p95_latency:.1f}s",
+        "scheduler_stats_empty": "暂无已完成的任务",
+        "prefix_cache_stats_line": "[前缀缓存] 共享前缀 {prefix_tokens} token，命中 {hits} 次，{cached_ms:.1f} ms/块（未用缓存 {uncached_ms:.1f} ms/块），占用 {used_mb:.1f}/{max_mb:.0f} MiB",
+        "preprocess_stats_line": "[预处理] {images} 张，平均 {timings}，像素量为原来的 {pixel_ratio:.0%}",
+        "ocr_tab": "文档识别",
+        "search_tab": "全文检索",
+        "search_query_label": "检索内容",
+        "search_query_placeholder": "输入关键词，多个关键词用空格分隔...",
+        "search_btn": "检索",
+        "search_summary": "共 {count} 条结果，耗时 {ms:.1f} ms（已索引 {documents} 个文档）",
+        "search_hit": "**{source_name}** · 第 {page} 页 · {block_type}\n> {snippet}",
+        "search_no_results": "未找到匹配的内容"
     },
     "en": {
         "title": "PDF OCR based on MinerU2.5-1.2B",
         "subtitle": "PDF and Image OCR Tool based on MinerU2.5-1.2B Model",
         "model_path_label": "Model Path",
-        "model_path_placeholder": "Please enter the absolute path to the model directory...(For Docker, input /app/checkpoints)",
+        "model_path_placeholder": "Please enter the absolute path to the model directory...(For Docker, input /app/checkpoints; for remote inference servers, input comma-separated http:// URLs)",
+        "replica_count_label": "Model Replicas",
+        "cpu_profile_label": "CPU Inference Profile",
+        "cpu_profile_auto": "Auto (no CPU tuning)",
+        "autotune_label": "Autotune batch size and replicas (replica count is the upper limit, result saved per machine)",
         "load_model_btn": "Load Model",
         "file_input_label": "Upload File",
+        "model_select_label": "Recognition Model",
         "process_btn": "Start OCR Recognition",
         "status_output_label": "Processing Status",
         "result_output_label": "Recognition Result (Markdown Format)",
@@ -96,14 +148,15 @@ TEXTS = {
         "instructions": [
             "1. **Set Model Path**: Enter the absolute path to the `MinerU2.5-1.2B` model directory (For Docker, input /app/checkpoints)",
             "2. **Click Load Model**: Wait for model loading to complete (status bar shows success)",
-            "3. **Upload File**: Supports PDF, JPG, JPEG, PNG, BMP formats",
+            "3. **Upload File**: Supports PDF, JPG, JPEG, PNG, BMP formats; multiple files or a zip archive can be uploaded at once",
             "4. **Start Recognition**: Click the Start OCR Recognition button and wait for processing to complete",
-            "5. **View Results**: Check the recognition results and download Markdown file on the right"
+            "5. **View Results**: Check the recognition results and download Markdown file on the right (multiple files are bundled into a zip)"
         ],
         "supported_formats_title": "Supported Formats",
         "supported_formats": [
             "PDF documents (multi-page automatic processing)",
-            "Image files: JPG, JPEG, PNG, BMP"
+            "Image files: JPG, JPEG, PNG, BMP",
+            "Zip archives (containing the files above)"
         ],
         "notes_title": "Notes",
         "notes": [
@@ -113,62 +166,60 @@ TEXTS = {
         "language_btn": "中文",
         # 状态和错误信息
         "model_not_loaded": "❌ Please load the model first! Click the 'Load Model' button above to complete model initialization before OCR recognition.",
+        "model_not_resident": "❌ The selected model has been unloaded. Please reload it or choose another model.",
         "no_file_uploaded": "❌ Please upload a file to recognize first!",
         "pdf_not_supported": "❌ PDF support is not enabled, please install pdf2image: pip install pdf2image",
         "unsupported_format": "❌ Unsupported file format {file_ext}",
-        "file_detected": "📄 File detected: {filename}",
-        "pdf_detected": "🔄 PDF file detected, starting conversion...",
-        "pdf_converted": "✅ PDF conversion completed, total {page_count} pages",
-        "image_detected": "🖼️ Image file detected, starting processing...",
-        "page_processed": "✅ Page {page_num} processed",
-        "image_processed": "✅ Image processing completed",
-        "ocr_completed": "✅ OCR processing completed! Results saved to: {filename}",
+        "no_supported_files": "❌ No recognizable PDF or image found in the uploaded files (including zip archives)",
+        "batch_queued": "⏳ Added {count} documents ({pages} pages) to the scheduling queue",
+        "job_waiting": "Waiting in queue...",
+        "file_waiting": "🕒 {filename}: queued ({total} pages)",
+        "file_progress": "🔄 {filename}: {done}/{total} pages done",
+        "file_completed": "✅ {filename} -> {output}",
+        "file_failed": "❌ {filename}: {error}",
+        "region_cache_stats": "♻️ Headers/footers reused {hits} times, recognized {misses} times",
+        "batch_completed": "✅ OCR processing completed! {succeeded} succeeded, {failed} failed. Results saved to: {filename}",
+        "batch_failed": "❌ All documents failed",
         "processing_error": "❌ Error occurred during processing: {error}",
         "model_loading": "Loading model...",
-        "processor_loading": "Loading processor...",
-        "client_initializing": "Initializing client...",
+        "replica_loading": "Loading model replica {index}/{total}...",
         "model_loaded": "Model loading completed",
         "model_load_success": "✅ Model loaded successfully!",
+        "runtime_settings": "⚙️ Batch size {batch_size}, replicas {replicas}",
         "model_path_not_exist": "❌ Error: Model path does not exist",
         "model_load_failed": "❌ Model loading failed: {error}",
-        "pdf_converting": "Converting PDF to images...",
-        "processing_page": "Processing page {page_num}...",
-        "processing_image": "Processing image...",
-        "generating_markdown": "Generating Markdown file...",
-        "processing_complete": "Processing completed"
+        "batch_progress": "Processing: {done}/{total} pages done...",
+        "creating_archive": "Packing result files...",
+        "processing_complete": "Processing completed",
+        "scheduler_stats_label": "Scheduler Statistics",
+        "refresh_stats_btn": "Refresh Statistics",
+        "scheduler_stats_header": "Policy: {policy}, active jobs: {active_jobs}",
+        "scheduler_stats_line": "[{size_class}] jobs {jobs}, mean wait {mean_wait:.1f}s, P50 latency {p50_latency:.1f}s, P95 latency {p95_latency:.1f}s",
+        "scheduler_stats_empty": "No completed jobs yet",
+        "prefix_cache_stats_line": "[Prefix cache] shared prefix {prefix_tokens} tokens, {hits} hits, {cached_ms:.1f} ms/block (uncached {uncached_ms:.1f} ms/block), using {used_mb:.1f}/{max_mb:.0f} MiB",
+        "preprocess_stats_line": "[Preprocessing] {images} images, mean {timings}, {pixel_ratio:.0%} of the original pixels",
+        "ocr_tab": "Recognition",
+        "search_tab": "Full-text Search",
+        "search_query_label": "Search",
+        "search_query_placeholder": "Enter keywords, separated by spaces...",
+        "search_btn": "Search",
+        "search_summary": "{count} results in {ms:.1f} ms ({documents} documents indexed)",
+        "search_hit": "**{source_name}** · page {page} · {block_type}\n> {snippet}",
+        "search_no_results": "No matching content found"
     }
 }
 
-def convert_pdf_to_images(pdf_path, output_dir=None, dpi=200):
-    """
-    将PDF转换为多张图片
-    """
-    if not PDF_SUPPORT:
-        raise ImportError("pdf2image未安装，无法处理PDF文件")
-    
-    # 创建临时目录（如果未指定）
-    if output_dir is None:
-        output_dir = tempfile.mkdtemp(prefix="pdf_ocr_")
-    else:
-        os.makedirs(output_dir, exist_ok=True)
-    
-    # 转换PDF为图片
-    images = convert_from_path(pdf_path, dpi=dpi)
-    
-    image_paths = []
-    for i, image in enumerate(images):
-        image_path = os.path.join(output_dir, f"page_{i+1:03d}.png")
-        image.save(image_path, 'PNG')
-        image_paths.append(image_path)
-    
-    return image_paths, output_dir
-
-def process_single_image(image_path, client):
+def process_single_image(image_path, client, region_cache=None, preprocessor=None):
     """
     处理单张图片的OCR
     """
-    image = Image.open(image_path)
-    extracted_blocks = client.two_step_extract(image)
+    image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+    if preprocessor is not None:
+        image = preprocessor(image)
+    if region_cache is None:
+        extracted_blocks = client.two_step_extract(image)
+    else:
+        extracted_blocks = cached_two_step_extract(client, image, region_cache)
     return extracted_blocks
 
 def save_ocr_results_as_formatted_md(all_extracted_blocks, original_path, multipage=False):
@@ -262,139 +313,377 @@ def process_blocks(blocks):
     
     return content_lines
 
-def initialize_model(model_path, current_lang, progress=gr.Progress()):
+def load_replica(model_path, cpu_profile=None):
     """
-    初始化模型和处理器
+    加载一个模型副本（模型、处理器和客户端），cpu_profile 为CPU推理配置名
     """
-    global global_model, global_processor, global_client
-    
-    try:
-        progress(0.1, desc=TEXTS[current_lang]["model_loading"])
-        
-        # 检查模型路径是否存在
-        if not os.path.exists(model_path):
-            return None, TEXTS[current_lang]["model_path_not_exist"]
-        
-        global_model = Qwen2VLForConditionalGeneration.from_pretrained(
+    if cpu_profile is None:
+        model = Qwen2VLForConditionalGeneration.from_pretrained(
             model_path,
             local_files_only=True,
             dtype="auto",
             device_map="auto"
         )
+    else:
+        model = load_cpu_model(model_path, cpu_profile)
+    
+    processor = AutoProcessor.from_pretrained(
+        model_path,
+        use_fast=True
+    )
+    
+    client = MinerUClient(
+        backend="transformers",
+        model=model,
+        processor=processor
+    )
+    return enable_prefix_cache(client, global_prefix_cache)
 
-        progress(0.6, desc=TEXTS[current_lang]["processor_loading"])
-        
-        global_processor = AutoProcessor.from_pretrained(
+def load_model_runtime(model_path, replicas=1, variant=None, progress=None, current_lang="zh", autotune=False):
+    """
+    加载模型副本池并创建推理调度器，由模型注册表在需要时调用
+    """
+    if is_remote_spec(model_path):
+        # 远程推理: 各副本共享同一个端点池，副本数即同时发出的批次数
+        endpoint_pool = RemoteEndpointPool.from_env(model_path)
+        pool = ReplicaPool(lambda: remote_client(endpoint_pool), size=replicas, health_check=remote_health_check)
+        pool.start_health_checks(interval=HEALTH_CHECK_INTERVAL)
+        return pool, InferenceScheduler.from_env(pool)
+    
+    # 自动调优: 本机已有该模型的记录时直接采用，否则以副本数为上限实测后保存；调优中加载的副本直接放入副本池
+    batch_size = None
+    tuned_replicas = []
+    if autotune:
+        settings, tuned_replicas = autotune_model(
+            lambda: load_replica(model_path, cpu_profile=variant),
             model_path,
-            use_fast=True
+            variant,
+            max_replicas=replicas,
+            progress=(lambda message: progress(0.0, desc=message)) if progress is not None else None
         )
+        # 模型注册表已按请求的副本数预留内存，调优结果只能减少副本
+        replicas, batch_size = min(replicas, settings["replicas"]), settings["batch_size"]
+    
+    # 首次加载时按副本汇报进度，之后出错副本的重建在后台静默进行
+    loaded = [0]
+    def create_replica():
+        if tuned_replicas:
+            client = tuned_replicas.pop()
+        else:
+            if progress is not None and loaded[0] < replicas:
+                progress(loaded[0] / replicas, desc=TEXTS[current_lang]["replica_loading"].format(index=loaded[0]+1, total=replicas))
+            client = load_replica(model_path, cpu_profile=variant)
+        loaded[0] += 1
+        if batch_size is not None:
+            client.client.batch_size = batch_size
+        return client
+    
+    # 显式指定了 OCR_INTRA_OP_THREADS 时各副本沿用该线程数，否则按副本数均分CPU核
+    pool = ReplicaPool(create_replica, size=replicas, torch_threads=configured_intra_op_threads() or None)
+    pool.start_health_checks(interval=HEALTH_CHECK_INTERVAL)
+    return pool, InferenceScheduler.from_env(pool, max_batch_size=batch_size)
+
+# 常驻模型注册表，按 LRU 淘汰，切换模型时进行中的任务仍在原模型上完成
+global_registry = ModelRegistry.from_env(load_model_runtime)
+
+def initialize_model(model_path, replica_count, cpu_profile, autotune, current_lang, progress=gr.Progress()):
+    """
+    加载模型（已常驻则直接切换）并设为默认模型
+    """
+    try:
+        progress(0.0, desc=TEXTS[current_lang]["model_loading"])
         
-        progress(0.9, desc=TEXTS[current_lang]["client_initializing"])
+        # 检查模型路径是否存在（远程推理端点无需本地路径）
+        if not is_remote_spec(model_path) and not os.path.exists(model_path):
+            return gr.update(), TEXTS[current_lang]["model_path_not_exist"]
         
-        global_client = MinerUClient(
-            backend="transformers",
-            model=global_model,
-            processor=global_processor
+        key = global_registry.load(
+            model_path,
+            variant=cpu_profile if cpu_profile in CPU_PROFILES and not is_remote_spec(model_path) else None,
+            replicas=max(1, int(replica_count or 1)),
+            progress=progress,
+            current_lang=current_lang,
+            autotune=bool(autotune) and not is_remote_spec(model_path)
         )
         
         progress(1.0, desc=TEXTS[current_lang]["model_loaded"])
-        return global_client, TEXTS[current_lang]["model_load_success"]
+        status_text = TEXTS[current_lang]["model_load_success"]
+        with global_registry.lease(key) as model_entry:
+            status_text += "\n" + TEXTS[current_lang]["runtime_settings"].format(
+                batch_size=model_entry.scheduler.max_batch_size, replicas=model_entry.pool.size
+            )
+        return gr.update(choices=global_registry.choices(), value=key), status_text
         
     except Exception as e:
-        return None, TEXTS[current_lang]["model_load_failed"].format(error=str(e))
+        return gr.update(), TEXTS[current_lang]["model_load_failed"].format(error=str(e))
 
-def process_file(input_file, current_lang, progress=gr.Progress()):
+def expand_uploads(input_files, extract_dir):
+    """
+    展开上传的文件，zip 压缩包内的PDF和图片解压到 extract_dir，返回 [(显示名称, 文件路径)]
     """
-    处理上传的文件
+    documents = []
+    for input_file in input_files:
+        file_path = input_file if isinstance(input_file, str) else input_file.name
+        if os.path.splitext(file_path)[1].lower() != '.zip':
+            documents.append((os.path.basename(file_path), file_path))
+            continue
+        archive_name = os.path.basename(file_path)
+        with zipfile.ZipFile(file_path) as archive:
+            for index, member in enumerate(archive.infolist()):
+                # 只取文件名，忽略压缩包内的目录结构，避免路径穿越
+                filename = os.path.basename(member.filename)
+                if member.is_dir() or filename.startswith('.') or os.path.splitext(filename)[1].lower() not in SUPPORTED_EXTENSIONS:
+                    continue
+                # 每个成员单独一个子目录，同名文件互不覆盖，结果文件沿用原文件名
+                member_dir = os.path.join(extract_dir, f"{len(documents)}_{index}")
+                os.makedirs(member_dir, exist_ok=True)
+                target_path = os.path.join(member_dir, filename)
+                with archive.open(member) as src, open(target_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                documents.append((f"{archive_name}/{member.filename}", target_path))
+    return documents
+
+class DocumentTask:
     """
-    global global_model, global_processor, global_client
+    批量任务中的一个文档: 页任务、页眉/页脚缓存、索引ID及最终结果
+    """
+
+    def __init__(self, display_name, file_path):
+        self.display_name = display_name
+        self.file_path = file_path
+        self.file_ext = os.path.splitext(file_path)[1].lower()
+        self.job = None
+        self.region_cache = None
+        self.doc_id = None
+        self.md_file = None
+        self.md_content = None
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.error is not None or self.md_file is not None
+
+def submit_document(task, model_entry):
+    """
+    为文档创建页任务并提交给页调度器，同一批次的各文档共用调度器和推理合批
+    """
+    # 每个文档作为独立任务与其他请求合批
+    job_client = model_entry.scheduler.client_for_job(uuid.uuid4().hex)
     
-    if global_model is None or global_processor is None or global_client is None:
-        return gr.update(), gr.update(), TEXTS[current_lang]["model_not_loaded"]
+    if task.file_ext == '.pdf':
+        # 同一文档内复用页眉/页脚的识别结果
+        task.region_cache = RegionCache()
+        
+        # 按页渲染，页面在调度器中与其他任务的页面交替执行
+        def recognize_page(page_index):
+            page_image = render_pdf_page(task.file_path, page_index + 1)
+            return process_single_image(page_image, job_client, task.region_cache, global_preprocessor)
+    else:
+        def recognize_page(page_index):
+            return process_single_image(task.file_path, job_client, preprocessor=global_preprocessor)
+    
+    # 每页识别完成即写入全文索引；同一文件重新识别时覆盖旧条目
+    task.doc_id = global_search_index.begin_document(task.file_path, task.display_name)
+    def run_page(page_index):
+        blocks = recognize_page(page_index)
+        global_search_index.index_page(task.doc_id, page_index + 1, blocks)
+        return blocks
     
-    if input_file is None:
-        return gr.update(), gr.update(), TEXTS[current_lang]["no_file_uploaded"]
+    # 预估任务规模后提交给页调度器
+    task.job = global_page_scheduler.submit(PageJob(
+        document_page_count(task.file_path), run_page, estimate_page_cost(task.file_path)
+    ))
+
+def finish_document(task):
+    """
+    页任务结束后保存Markdown并完成索引
+    """
+    if task.job.error is not None:
+        task.error = str(task.job.error)
+        # 识别失败时放弃本次写入的条目，之前完成的索引保持不变
+        global_search_index.discard_document(task.doc_id)
+        return
+    if task.file_ext == '.pdf':
+        task.md_file, task.md_content = save_ocr_results_as_formatted_md(task.job.results, task.file_path, multipage=True)
+    else:
+        task.md_file, task.md_content = save_ocr_results_as_formatted_md(task.job.results[0], task.file_path, multipage=False)
+    global_search_index.finish_document(task.doc_id, task.md_file, task.job.page_count)
+
+def format_batch_status(tasks, current_lang, header_messages):
+    """
+    汇总各文档的进度，每个文档一行
+    """
+    texts = TEXTS[current_lang]
+    lines = list(header_messages)
+    for task in tasks:
+        if task.error is not None:
+            lines.append(texts["file_failed"].format(filename=task.display_name, error=task.error))
+        elif task.md_file is not None:
+            line = texts["file_completed"].format(filename=task.display_name, output=os.path.basename(task.md_file))
+            if task.region_cache is not None:
+                line += "  " + texts["region_cache_stats"].format(hits=task.region_cache.hits, misses=task.region_cache.misses)
+            lines.append(line)
+        elif task.job.first_dispatched_at is None:
+            lines.append(texts["file_waiting"].format(filename=task.display_name, total=task.job.page_count))
+        else:
+            lines.append(texts["file_progress"].format(filename=task.display_name, done=len(task.job.completed), total=task.job.page_count))
+    return "\n".join(lines)
+
+def create_results_archive(tasks):
+    """
+    把本批次生成的Markdown文件打包为一个zip，返回压缩包路径
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir = "output"
+    os.makedirs(output_dir, exist_ok=True)
+    archive_path = os.path.join(output_dir, f"OCR_Batch_{timestamp}_{uuid.uuid4().hex[:6]}.zip")
+    used_names = set()
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for task in tasks:
+            arcname = os.path.basename(task.md_file)
+            # 同名文件在同一秒生成时结果文件名相同（磁盘上后者覆盖前者），压缩包内加序号区分并写入各自内容
+            stem, ext = os.path.splitext(arcname)
+            suffix = 1
+            while arcname in used_names:
+                suffix += 1
+                arcname = f"{stem}_{suffix}{ext}"
+            used_names.add(arcname)
+            archive.writestr(arcname, task.md_content)
+    return archive_path
+
+def process_file(input_files, model_key, current_lang, progress=gr.Progress()):
+    """
+    处理上传的文件（可多选，也可上传zip压缩包），处理期间持续输出各文档进度
+    """
+    if global_registry.default_key is None:
+        yield gr.update(), gr.update(), TEXTS[current_lang]["model_not_loaded"]
+        return
     
-    temp_dir = None
-    status_messages = []
+    if not input_files:
+        yield gr.update(), gr.update(), TEXTS[current_lang]["no_file_uploaded"]
+        return
+    if not isinstance(input_files, list):
+        input_files = [input_files]
     
-    # 定义进度区间
-    progress_ranges = {
-        'pdf_conversion': (0.0, 0.2),      # 20%
-        'page_processing': (0.2, 0.9),     # 70% 
-        'markdown_generation': (0.9, 0.95), # 5%
-        'completion': (0.95, 1.0)           # 5%
-    }
+    # 租用所选模型直到任务结束，期间切换或淘汰模型都不影响本任务
+    extract_dir = tempfile.mkdtemp(prefix="ocr_upload_")
+    try:
+        with global_registry.lease(model_key) as model_entry:
+            yield from run_ocr_job(input_files, extract_dir, model_entry, current_lang, progress)
+    except ModelNotResident:
+        # 仅租用失败时提示；处理过程中的其他异常照常抛出
+        yield gr.update(), gr.update(), TEXTS[current_lang]["model_not_resident"]
+    finally:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+
+def run_ocr_job(input_files, extract_dir, model_entry, current_lang, progress):
+    """
+    在租用的模型上执行一批OCR任务，全部文档的页面一次性提交给页调度器
+    """
+    texts = TEXTS[current_lang]
+    header_messages = []
     
     try:
-        # 检查文件类型
-        file_ext = os.path.splitext(input_file.name)[1].lower()
-        status_messages.append(TEXTS[current_lang]["file_detected"].format(filename=os.path.basename(input_file.name)))
-        
-        if file_ext == '.pdf':
-            if not PDF_SUPPORT:
-                return gr.update(), gr.update(), TEXTS[current_lang]["pdf_not_supported"]
-            
-            status_messages.append(TEXTS[current_lang]["pdf_detected"])
-            progress(progress_ranges['pdf_conversion'][1], desc=TEXTS[current_lang]["pdf_converting"])
-            
-            # 转换PDF为图片
-            image_paths, temp_dir = convert_pdf_to_images(input_file.name)
-            status_messages.append(TEXTS[current_lang]["pdf_converted"].format(page_count=len(image_paths)))
-            
-            # 处理每一页 - 使用进度区间计算
-            all_blocks = []
-            page_start, page_end = progress_ranges['page_processing']
-            for i, image_path in enumerate(image_paths):
-                # 计算当前页面处理的进度
-                current_progress = page_start + (i / len(image_paths)) * (page_end - page_start)
-                progress(current_progress, desc=TEXTS[current_lang]["processing_page"].format(page_num=i+1))
-                blocks = process_single_image(image_path, global_client)
-                all_blocks.append(blocks)
-                status_messages.append(TEXTS[current_lang]["page_processed"].format(page_num=i+1))
-            
-            progress(progress_ranges['markdown_generation'][1], desc=TEXTS[current_lang]["generating_markdown"])
-            # 保存为多页Markdown
-            md_file, md_content = save_ocr_results_as_formatted_md(all_blocks, input_file.name, multipage=True)
-            
-        elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp']:
-            status_messages.append(TEXTS[current_lang]["image_detected"])
-            # 单张图片处理直接使用页面处理的结束点
-            progress(progress_ranges['page_processing'][1], desc=TEXTS[current_lang]["processing_image"])
-            
-            # 处理单张图片
-            blocks = process_single_image(input_file.name, global_client)
-            status_messages.append(TEXTS[current_lang]["image_processed"])
-            
-            progress(progress_ranges['markdown_generation'][1], desc=TEXTS[current_lang]["generating_markdown"])
-            md_file, md_content = save_ocr_results_as_formatted_md(blocks, input_file.name, multipage=False)
-            
+        documents = expand_uploads(input_files, extract_dir)
+    except zipfile.BadZipFile as e:
+        yield gr.update(), gr.update(), texts["processing_error"].format(error=str(e))
+        return
+    if not documents:
+        yield gr.update(), gr.update(), texts["no_supported_files"]
+        return
+    
+    tasks = [DocumentTask(display_name, file_path) for display_name, file_path in documents]
+    for task in tasks:
+        if task.file_ext not in SUPPORTED_EXTENSIONS:
+            task.error = texts["unsupported_format"].format(file_ext=task.file_ext)
+        elif task.file_ext == '.pdf' and not PDF_SUPPORT:
+            task.error = texts["pdf_not_supported"]
         else:
-            return gr.update(), gr.update(), TEXTS[current_lang]["unsupported_format"].format(file_ext=file_ext)
-        
-        progress(progress_ranges['completion'][1], desc=TEXTS[current_lang]["processing_complete"])
-        status_messages.append(TEXTS[current_lang]["ocr_completed"].format(filename=md_file))
-        
-        # 返回结果
-        status_text = "\n".join(status_messages)
-        return md_content, md_file, status_text
-        
-    except Exception as e:
-        status_messages.append(TEXTS[current_lang]["processing_error"].format(error=str(e)))
-        status_text = "\n".join(status_messages)
-        return gr.update(), gr.update(), status_text
-        
-    finally:
-        # 清理临时文件
-        if temp_dir:
-            cleanup_temp_files(temp_dir)
+            try:
+                submit_document(task, model_entry)
+            except Exception as e:
+                task.error = str(e)
+    
+    pending = [task for task in tasks if not task.finished]
+    total_pages = sum(task.job.page_count for task in pending)
+    header_messages.append(texts["batch_queued"].format(count=len(tasks), pages=total_pages))
+    
+    # 等待各文档完成，期间按全部文档的已完成页数刷新总进度，并逐个保存已完成的文档
+    while pending:
+        pending[0].job.wait(timeout=0.5)
+        for task in [task for task in pending if task.job.done.is_set()]:
+            try:
+                finish_document(task)
+            except Exception as e:
+                task.error = str(e)
+            pending.remove(task)
+        done_pages = sum(len(task.job.completed) for task in tasks if task.job is not None)
+        if pending and all(task.job.first_dispatched_at is None for task in pending):
+            desc = texts["job_waiting"]
+        else:
+            desc = texts["batch_progress"].format(done=done_pages, total=total_pages)
+        progress(0.95 * done_pages / max(total_pages, 1), desc=desc)
+        yield gr.update(), gr.update(), format_batch_status(tasks, current_lang, header_messages)
+    
+    succeeded = [task for task in tasks if task.md_file is not None]
+    failed_count = len(tasks) - len(succeeded)
+    if not succeeded:
+        header_messages.append(texts["batch_failed"])
+        yield gr.update(), gr.update(), format_batch_status(tasks, current_lang, header_messages)
+        return
+    
+    if len(tasks) == 1:
+        # 单个文档直接提供Markdown文件下载
+        result_file = succeeded[0].md_file
+        result_content = succeeded[0].md_content
+    else:
+        progress(0.95, desc=texts["creating_archive"])
+        result_file = create_results_archive(succeeded)
+        result_content = "\n\n---\n\n".join(task.md_content for task in succeeded)
+    
+    progress(1.0, desc=texts["processing_complete"])
+    header_messages.append(texts["batch_completed"].format(succeeded=len(succeeded), failed=failed_count, filename=result_file))
+    yield result_content, result_file, format_batch_status(tasks, current_lang, header_messages)
+
+def format_scheduler_stats(current_lang):
+    """
+    格式化页调度器按任务规模统计的延迟
+    """
+    stats = global_page_scheduler.stats()
+    texts = TEXTS[current_lang]
+    lines = [texts["scheduler_stats_header"].format(policy=stats["policy"], active_jobs=stats["active_jobs"])]
+    for name, item in stats["classes"].items():
+        lines.append(texts["scheduler_stats_line"].format(size_class=name, **item))
+    if not stats["classes"]:
+        lines.append(texts["scheduler_stats_empty"])
+    prefix_stats = global_prefix_cache.stats()
+    if prefix_stats["hits"] + prefix_stats["misses"]:
+        lines.append(texts["prefix_cache_stats_line"].format(
+            cached_ms=prefix_stats["cached"]["ms_per_request"],
+            uncached_ms=prefix_stats["uncached"]["ms_per_request"],
+            used_mb=prefix_stats["bytes"] / (1 << 20),
+            max_mb=prefix_stats["max_bytes"] / (1 << 20),
+            **prefix_stats
+        ))
+    if global_preprocessor.enabled:
+        preprocess_stats = global_preprocessor.stats()
+        timings = ", ".join(f"{step} {item['mean_ms']:.1f}ms" for step, item in preprocess_stats["steps"].items())
+        lines.append(texts["preprocess_stats_line"].format(images=preprocess_stats["images"], timings=timings, pixel_ratio=preprocess_stats["pixel_ratio"]))
+    return "\n".join(lines)
 
-def cleanup_temp_files(temp_dir):
+def search_documents(query, current_lang):
     """
-    清理临时文件
+    全文检索已识别的文档，返回 Markdown 格式的命中列表
     """
-    if temp_dir and os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
+    texts = TEXTS[current_lang]
+    start = time.perf_counter()
+    hits = global_search_index.search(query or "")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    lines = [texts["search_summary"].format(count=len(hits), ms=elapsed_ms, documents=global_search_index.stats()["documents"])]
+    if not hits:
+        lines.append(texts["search_no_results"])
+    lines.extend(texts["search_hit"].format(**hit) for hit in hits)
+    return "\n\n".join(lines)
 
 def create_gradio_interface():
     """
@@ -413,51 +702,101 @@ def create_gradio_interface():
                 with gr.Column(scale=1):
                     language_btn = gr.Button("English", size="sm")
         
-        with gr.Row():
-            with gr.Column(scale=2):
-                # 模型路径输入
-                model_path = gr.Textbox(
-                    label="模型路径",
-                    placeholder="请输入模型文件夹的绝对路径...（如为Docker,输入 /app/checkpoints ）",
-                    lines=2,        # 显示行数
-                    max_lines=3,    # 最大行数，输入过长时自动滚动
-                )
-                
-                # 模型加载按钮
-                load_model_btn = gr.Button("加载模型", variant="primary")
-                
-                # 文件上传
-                file_input = gr.File(
-                    label="上传文件",
-                    file_types=[".pdf", ".jpg", ".jpeg", ".png", ".bmp"],
-                    file_count="single"  # 明确指定单文件
-                )
-                
-                # 处理按钮
-                process_btn = gr.Button("开始OCR识别", variant="primary")
-            
-            with gr.Column(scale=3):
-                # 状态显示
-                status_output = gr.Textbox(
-                    label="处理状态",
-                    lines=10,
-                    max_lines=15,
-                    interactive=False
-                )
-                
-                # 结果显示
-                result_output = gr.Textbox(
-                    label="识别结果 (Markdown格式)",
-                    lines=20,
-                    max_lines=25,
-                    show_copy_button=True
-                )
-                
-                # 文件下载
-                file_output = gr.File(
-                    label="下载结果文件",
-                    file_types=[".md"]
-                )
+        with gr.Tabs():
+            with gr.Tab("文档识别") as ocr_tab:
+                with gr.Row():
+                    with gr.Column(scale=2):
+                        # 模型路径输入
+                        model_path = gr.Textbox(
+                            label="模型路径",
+                            placeholder="请输入模型文件夹的绝对路径...（如为Docker,输入 /app/checkpoints ；远程推理服务输入逗号分隔的 http:// 地址）",
+                            lines=2,        # 显示行数
+                            max_lines=3,    # 最大行数，输入过长时自动滚动
+                        )
+                        
+                        # 模型副本数，每个副本可独立并行推理
+                        replica_count = gr.Number(
+                            label="模型副本数",
+                            value=ReplicaPool.size_from_env(),
+                            minimum=1,
+                            precision=0
+                        )
+                        
+                        # CPU推理配置，仅CPU环境下选用
+                        cpu_profile = gr.Dropdown(
+                            label="CPU推理配置",
+                            choices=[("自动（不启用CPU优化）", "auto")] + list(CPU_PROFILES),
+                            value=os.environ.get("OCR_CPU_PROFILE", "auto")
+                        )
+                        
+                        # 加载时自动调优批大小和副本数（仅本地模型）
+                        autotune = gr.Checkbox(
+                            label="自动调优批大小与副本数（副本数作为上限，结果按本机保存）",
+                            value=os.environ.get("OCR_AUTOTUNE", "0").lower() in ("1", "true", "yes")
+                        )
+                        
+                        # 模型加载按钮
+                        load_model_btn = gr.Button("加载模型", variant="primary")
+                        
+                        # 文件上传
+                        file_input = gr.File(
+                            label="上传文件",
+                            file_types=list(SUPPORTED_EXTENSIONS) + [".zip"],
+                            file_count="multiple"  # 可多选，也可上传zip压缩包
+                        )
+                        
+                        # 模型选择，默认使用最近加载的模型
+                        model_select = gr.Dropdown(
+                            label="识别模型",
+                            choices=[],
+                            value=None,
+                            interactive=True
+                        )
+                        
+                        # 处理按钮
+                        process_btn = gr.Button("开始OCR识别", variant="primary")
+                    
+                    with gr.Column(scale=3):
+                        # 状态显示
+                        status_output = gr.Textbox(
+                            label="处理状态",
+                            lines=10,
+                            max_lines=15,
+                            interactive=False
+                        )
+                        
+                        # 结果显示
+                        result_output = gr.Textbox(
+                            label="识别结果 (Markdown格式)",
+                            lines=20,
+                            max_lines=25,
+                            show_copy_button=True
+                        )
+                        
+                        # 文件下载
+                        file_output = gr.File(
+                            label="下载结果文件",
+                            file_types=[".md", ".zip"]
+                        )
+                        
+                        # 调度统计
+                        scheduler_stats = gr.Textbox(
+                            label="调度统计",
+                            lines=4,
+                            interactive=False
+                        )
+                        refresh_stats_btn = gr.Button("刷新统计", size="sm")
+                    
+            # 全文检索
+            with gr.Tab("全文检索") as search_tab:
+                with gr.Row():
+                    search_query = gr.Textbox(
+                        label="检索内容",
+                        placeholder="输入关键词，多个关键词用空格分隔...",
+                        scale=5
+                    )
+                    search_btn = gr.Button("检索", variant="primary", scale=1)
+                search_results = gr.Markdown()
         
         # 说明区域
         with gr.Row(equal_height=True):
@@ -468,15 +807,16 @@ def create_gradio_interface():
                 instructions_content = gr.Markdown("""
                 1. **设置模型路径**: 输入 `MinerU2.5-1.2B` 模型文件夹的绝对路径（如为Docker,输入 /app/checkpoints ）
                 2. **点击加载模型**: 等待模型加载完成（状态栏显示成功）
-                3. **上传文件**: 支持 PDF、JPG、JPEG、PNG、BMP 格式
+                3. **上传文件**: 支持 PDF、JPG、JPEG、PNG、BMP 格式，可一次上传多个文件或zip压缩包
                 4. **开始识别**: 点击开始OCR识别按钮，等待处理完成
-                5. **查看结果**: 在右侧查看识别结果和下载Markdown文件
+                5. **查看结果**: 在右侧查看识别结果和下载Markdown文件（多个文件打包为zip）
                 """)
                 
                 supported_formats_title = gr.Markdown("### 支持的格式")
                 supported_formats_content = gr.Markdown("""
                 - PDF 文档（多页自动处理）
                 - 图片文件: JPG, JPEG, PNG, BMP
+                - zip 压缩包（内含上述文件）
                 """)
                 
                 notes_title = gr.Markdown("### 注意事项")
@@ -500,12 +840,22 @@ def create_gradio_interface():
                 gr.update(value=f"# {texts['title']}"),  # title_md
                 gr.update(value=texts['subtitle']),     # subtitle_md
                 gr.update(label=texts['model_path_label'], placeholder=texts['model_path_placeholder']),  # model_path
+                gr.update(label=texts['replica_count_label']),  # replica_count
+                gr.update(label=texts['cpu_profile_label'], choices=[(texts['cpu_profile_auto'], "auto")] + list(CPU_PROFILES)),  # cpu_profile
+                gr.update(label=texts['autotune_label']),  # autotune
                 gr.update(value=texts['load_model_btn']), # load_model_btn
                 gr.update(label=texts['file_input_label']), # file_input
+                gr.update(label=texts['model_select_label']),  # model_select
                 gr.update(value=texts['process_btn']),    # process_btn
                 gr.update(label=texts['status_output_label']),  # status_output
                 gr.update(label=texts['result_output_label']),  # result_output
                 gr.update(label=texts['file_output_label']), # file_output
+                gr.update(label=texts['scheduler_stats_label']),  # scheduler_stats
+                gr.update(value=texts['refresh_stats_btn']),  # refresh_stats_btn
+                gr.update(label=texts['ocr_tab']),  # ocr_tab
+                gr.update(label=texts['search_tab']),  # search_tab
+                gr.update(label=texts['search_query_label'], placeholder=texts['search_query_placeholder']),  # search_query
+                gr.update(value=texts['search_btn']),  # search_btn
                 gr.update(value=f"### {texts['instructions_title']}"),  # instructions_title
                 gr.update(value=instructions_text),     # instructions_content
                 gr.update(value=f"### {texts['supported_formats_title']}"),  # supported_formats_title
@@ -519,14 +869,32 @@ def create_gradio_interface():
         # 事件处理
         load_model_btn.click(
             fn=initialize_model,
-            inputs=[model_path, current_lang],
-            outputs=[gr.Number(visible=False), status_output]
+            inputs=[model_path, replica_count, cpu_profile, autotune, current_lang],
+            outputs=[model_select, status_output]
         )
 
         process_btn.click(
             fn=process_file,
-            inputs=[file_input, current_lang],
-            outputs=[result_output, file_output, status_output]
+            inputs=[file_input, model_select, current_lang],
+            outputs=[result_output, file_output, status_output],
+            concurrency_limit=MAX_CONCURRENT_JOBS
+        )
+        
+        refresh_stats_btn.click(
+            fn=format_scheduler_stats,
+            inputs=[current_lang],
+            outputs=[scheduler_stats]
+        )
+        
+        search_btn.click(
+            fn=search_documents,
+            inputs=[search_query, current_lang],
+            outputs=[search_results]
+        )
+        search_query.submit(
+            fn=search_documents,
+            inputs=[search_query, current_lang],
+            outputs=[search_results]
         )
         
         # 语言切换事件
@@ -534,9 +902,9 @@ def create_gradio_interface():
             fn=switch_language,
             inputs=[current_lang],
             outputs=[
-                title_md, subtitle_md, model_path, load_model_btn, file_input,
-                process_btn, status_output, result_output, file_output,
-                instructions_title, instructions_content, supported_formats_title,
+                title_md, subtitle_md, model_path, replica_count, cpu_profile, autotune, load_model_btn, file_input,
+                model_select, process_btn, status_output, result_output, file_output,
+                scheduler_stats, refresh_stats_btn, ocr_tab, search_tab, search_query, search_btn, instructions_title, instructions_content, supported_formats_title,
                 supported_formats_content, notes_title, notes_content, language_btn,
                 current_lang
             ]